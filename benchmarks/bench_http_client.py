@@ -0,0 +1,83 @@
+"""Per-run latency of the upload stage with a fresh client vs the pooled client.
+
+    python -m benchmarks.bench_http_client --runs 50 --concurrency 4
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+from sage_identification_pipeline.connections import create_client
+from sage_identification_pipeline.sage_client import SageClient
+
+from .stub_server import create_stub_app, start_server, stop_server
+
+
+async def fresh_client_run(base_url, image_path):
+    async with SageClient(base_url=base_url) as sage:
+        await sage.upload(image_path)
+
+
+async def measure(label, runs, concurrency, run):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed_run():
+        async with semaphore:
+            start = time.perf_counter()
+            await run()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[timed_run() for _ in range(runs)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(
+        f'{label:<14} runs={runs:<5} mean={statistics.mean(latencies) * 1000:7.2f}ms '
+        f'p50={statistics.median(latencies) * 1000:7.2f}ms p95={p95 * 1000:7.2f}ms '
+        f'throughput={runs / elapsed:7.1f} runs/s'
+    )
+
+
+async def main(args):
+    server, task = await start_server(create_stub_app(args.latency), port=args.port)
+    base_url = f'http://127.0.0.1:{args.port}'
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image:
+            image.write(b'\0' * args.image_bytes)
+            image.flush()
+
+            await measure(
+                'fresh client',
+                args.runs,
+                args.concurrency,
+                lambda: fresh_client_run(base_url, image.name),
+            )
+
+            client = create_client(base_url=base_url)
+            sage = SageClient(http_client=client)
+            try:
+                await measure(
+                    'pooled client',
+                    args.runs,
+                    args.concurrency,
+                    lambda: sage.upload(image.name),
+                )
+            finally:
+                await sage.aclose()
+                await client.aclose()
+    finally:
+        await stop_server(server, task)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub latency (s)')
+    parser.add_argument('--image-bytes', type=int, default=256 * 1024)
+    parser.add_argument('--port', type=int, default=5005)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,182 @@
+"""End-to-end load benchmark of the pipeline against the local fake WBIA.
+
+Drives N concurrent pipeline executions (the Wave-free core of run_pipeline)
+and reports throughput, per-stage latency percentiles and event-loop lag.
+With --stage-workers, runs go through a StageScheduler with that many workers
+per stage instead of running their stages back to back. With --batched, all
+runs go through one execute_pipelines call, which shares detection and
+classification jobs between images.
+
+    python -m benchmarks.bench_pipeline --runs 100 --concurrency 50 --job-duration 2
+    python -m benchmarks.bench_pipeline --runs 100 --stage-workers 8 --job-duration 2
+    python -m benchmarks.bench_pipeline --runs 100 --batched --job-duration 2
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+# Keep benchmark uploads out of the persisted upload cache.
+os.environ.setdefault('SAGE_UPLOAD_CACHE_PERSIST', '0')
+
+from sage_identification_pipeline.connections import create_client  # noqa: E402
+from sage_identification_pipeline.jobs import JobMultiplexer  # noqa: E402
+from sage_identification_pipeline.sage import (  # noqa: E402
+    execute_pipeline,
+    execute_pipelines,
+)
+from sage_identification_pipeline.sage_client import SageClient  # noqa: E402
+from sage_identification_pipeline.scheduler import StageScheduler  # noqa: E402
+from sage_identification_pipeline.state import PIPELINE_STAGES, PipelineRun  # noqa: E402
+
+from .fake_wbia import FakeWBIA  # noqa: E402
+from .stub_server import start_server, stop_server  # noqa: E402
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def monitor_loop_lag(interval, lags, stop):
+    loop = asyncio.get_event_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def main(args):
+    fake = FakeWBIA(
+        latency=args.latency,
+        detection_duration=args.job_duration,
+        classification_duration=args.job_duration,
+        identification_duration=args.job_duration,
+        annotations_per_image=args.annotations,
+    )
+    server, server_task = await start_server(fake.app(), port=args.port)
+    client = create_client(base_url=f'http://127.0.0.1:{args.port}')
+    sage = SageClient(
+        http_client=client,
+        multiplexer=JobMultiplexer(tick_interval=args.poll_tick, client=client),
+    )
+    image_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    semaphore = asyncio.Semaphore(args.concurrency)
+    scheduler = None
+    if args.stage_workers:
+        scheduler = StageScheduler(
+            workers={stage: args.stage_workers for stage in PIPELINE_STAGES}
+        )
+    timings, failures, depths = [], [], []
+
+    def write_image(index):
+        # Distinct image content per run, so no run is served from a cache.
+        image_path = os.path.join(image_dir, f'{index}.jpg')
+        with open(image_path, 'wb') as image_fp:
+            image_fp.write(os.urandom(args.image_bytes))
+        return image_path
+
+    async def one_run(index):
+        image_path = write_image(index)
+        run = PipelineRun(target_image=image_path)
+        if scheduler is None:
+            await semaphore.acquire()
+        started_at = time.perf_counter()
+        try:
+            await execute_pipeline(sage, run, image_path, scheduler=scheduler)
+        except Exception as error:
+            failures.append(error)
+            return
+        finally:
+            if scheduler is None:
+                semaphore.release()
+        timing = dict(run.stage_durations)
+        timing['total'] = time.perf_counter() - started_at
+        timings.append(timing)
+
+    async def all_runs_batched():
+        images = [write_image(index) for index in range(args.runs)]
+        batch_runs = [PipelineRun(target_image=image) for image in images]
+        started_at = time.perf_counter()
+        errors = await execute_pipelines(sage, batch_runs, images)
+        for run, error in zip(batch_runs, errors):
+            if error is not None:
+                failures.append(error)
+                continue
+            timing = dict(run.stage_durations)
+            timing['total'] = time.perf_counter() - started_at
+            timings.append(timing)
+
+    async def sample_depths():
+        while True:
+            await asyncio.sleep(0.1)
+            depths.append(scheduler.depths())
+
+    lags, stop = [], asyncio.Event()
+    monitor = asyncio.ensure_future(monitor_loop_lag(0.01, lags, stop))
+    if scheduler is not None:
+        sampler = asyncio.ensure_future(sample_depths())
+    start = time.perf_counter()
+    try:
+        if args.batched:
+            await all_runs_batched()
+        else:
+            await asyncio.gather(*[one_run(index) for index in range(args.runs)])
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await monitor
+        if scheduler is not None:
+            sampler.cancel()
+            await scheduler.close()
+        await sage.aclose()
+        await client.aclose()
+        await stop_server(server, server_task)
+        shutil.rmtree(image_dir, ignore_errors=True)
+
+    print(
+        f'runs={args.runs} concurrency={args.concurrency} '
+        f'stage_workers={args.stage_workers} failures={len(failures)} '
+        f'elapsed={elapsed:.2f}s throughput={len(timings) / elapsed:.2f} runs/s '
+        f'wbia_requests={fake.requests} wbia_jobs={fake.jobs_started}'
+    )
+    print(f'{"stage":<16}{"p50 (s)":>10}{"p95 (s)":>10}{"p99 (s)":>10}')
+    for stage in PIPELINE_STAGES + ('total',):
+        values = [timing[stage] for timing in timings if stage in timing]
+        print(
+            f'{stage:<16}{percentile(values, 0.50):>10.3f}'
+            f'{percentile(values, 0.95):>10.3f}{percentile(values, 0.99):>10.3f}'
+        )
+    print(
+        f'event loop lag: p50={percentile(lags, 0.50) * 1000:.1f}ms '
+        f'p99={percentile(lags, 0.99) * 1000:.1f}ms max={max(lags) * 1000:.1f}ms'
+    )
+    if depths:
+        print(
+            'max queue depth: '
+            + ' '.join(
+                f'{stage}={max(sample[stage] for sample in depths)}'
+                for stage in PIPELINE_STAGES
+            )
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument(
+        '--stage-workers', type=int, default=0, help='workers per stage (0: no scheduler)'
+    )
+    parser.add_argument('--batched', action='store_true', help='use execute_pipelines')
+    parser.add_argument('--latency', type=float, default=0.01, help='per request (s)')
+    parser.add_argument('--job-duration', type=float, default=2.0, help='per job (s)')
+    parser.add_argument('--annotations', type=int, default=3, help='per image')
+    parser.add_argument('--poll-tick', type=float, default=0.5)
+    parser.add_argument('--image-bytes', type=int, default=512 * 1024)
+    parser.add_argument('--port', type=int, default=5006)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,152 @@
+"""Startup benchmark: publishing the app's assets on a cold and a warm start.
+
+Publishes the logo and example images to a stub Wave file store, as
+initialize_app does, and reports:
+
+- sequential: the two blocking q.site.upload calls startup used to make,
+- cold: publish_assets with an empty manifest (everything is uploaded),
+- warm: publish_assets with the manifest of the cold start (nothing is).
+
+The stub store serves uploads at --bandwidth MB/s after --latency seconds.
+
+    python -m benchmarks.bench_startup --latency 0.05 --bandwidth 20
+"""
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+# The stub Wave server stands in for the real one (see connections.py).
+os.environ.setdefault('H2O_WAVE_ADDRESS', 'http://127.0.0.1:5007')
+
+import httpx  # noqa: E402
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import JSONResponse, Response  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+from sage_identification_pipeline.config import WAVE_ADDRESS  # noqa: E402
+from sage_identification_pipeline.connections import close_client  # noqa: E402
+from sage_identification_pipeline.constants import example_images  # noqa: E402
+from sage_identification_pipeline.initializers import LOGO_PATH  # noqa: E402
+from sage_identification_pipeline.site_assets import (  # noqa: E402
+    AssetManifest,
+    publish_assets,
+)
+
+from .stub_server import start_server, stop_server  # noqa: E402
+
+
+class StubWaveStore:
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bytes_per_second = bandwidth * 1024 * 1024 if bandwidth else None
+        self.uploads = 0
+        self._files = set()
+
+    def app(self):
+        return Starlette(
+            routes=[
+                Route('/_f', self.upload, methods=['POST']),
+                Route('/_f/{path:path}', self.download),
+            ]
+        )
+
+    async def upload(self, request):
+        # Parsed by hand; starlette's form parsing needs python-multipart.
+        body = await request.body()
+        if self.bytes_per_second:
+            await asyncio.sleep(len(body) / self.bytes_per_second)
+        await asyncio.sleep(self.latency)
+        paths = []
+        for filename in re.findall(rb'filename="([^"]*)"', body):
+            self.uploads += 1
+            path = f'/_f/{uuid.uuid4()}/{filename.decode()}'
+            self._files.add(path)
+            paths.append(path)
+        return JSONResponse({'files': paths})
+
+    async def download(self, request):
+        if request.url.path not in self._files:
+            return Response(status_code=404)
+        return Response(b'')
+
+
+class StubSite:
+    """Uploads like h2o_wave's AsyncSite.upload."""
+
+    def __init__(self, http):
+        self.http = http
+
+    async def upload(self, files):
+        response = await self.http.post(
+            f'{WAVE_ADDRESS}/_f',
+            files=[('files', (os.path.basename(f), open(f, 'rb'))) for f in files],
+        )
+        response.raise_for_status()
+        return response.json()['files']
+
+
+async def timed(coro):
+    started = time.perf_counter()
+    result = await coro
+    return time.perf_counter() - started, result
+
+
+async def sequential_upload(site, file_paths):
+    await site.upload(file_paths[:1])
+    await site.upload([path for path in file_paths[1:] if os.path.isfile(path)])
+
+
+async def main(args):
+    store = StubWaveStore(args.latency, args.bandwidth)
+    port = httpx.URL(WAVE_ADDRESS).port
+    server, server_task = await start_server(store.app(), port=port)
+    manifest_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    manifest_path = os.path.join(manifest_dir, 'asset_manifest.json')
+    file_paths = [LOGO_PATH] + [image['path'] for image in example_images]
+    total_bytes = sum(os.path.getsize(path) for path in file_paths if os.path.isfile(path))
+    print(f'{len(file_paths)} assets, {total_bytes / 1024 / 1024:.1f} MB')
+
+    try:
+        async with httpx.AsyncClient(timeout=None) as http:
+            site = StubSite(http)
+            for _run in range(args.repeat):
+                uploads = store.uploads
+                seconds, _ = await timed(sequential_upload(site, file_paths))
+                print(f'sequential: {seconds:.3f}s, {store.uploads - uploads} uploads')
+
+                os.makedirs(manifest_dir, exist_ok=True)
+                if os.path.exists(manifest_path):
+                    os.remove(manifest_path)
+                uploads = store.uploads
+                seconds, _ = await timed(
+                    publish_assets(site, file_paths, AssetManifest(manifest_path), args.concurrency)
+                )
+                print(f'cold:       {seconds:.3f}s, {store.uploads - uploads} uploads')
+
+                uploads = store.uploads
+                seconds, _ = await timed(
+                    publish_assets(site, file_paths, AssetManifest(manifest_path), args.concurrency)
+                )
+                print(f'warm:       {seconds:.3f}s, {store.uploads - uploads} uploads')
+    finally:
+        await close_client()
+        await stop_server(server, server_task)
+        shutil.rmtree(manifest_dir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench_startup')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per upload request')
+    parser.add_argument('--bandwidth', type=float, default=20.0, help='MB/s per upload, 0 for unlimited')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=1)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,192 @@
+"""A local stand-in for the WBIA endpoints used by the pipeline.
+
+Jobs finish after a configurable duration and every request can be delayed
+by a fixed latency, so pipelines can be driven without network access. A
+share of the JSON responses can be replaced by 502 errors, to exercise the
+client's retries.
+
+    python -m benchmarks.fake_wbia --port 5005 --latency 0.05 --job-duration 2
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+import uuid
+from urllib.parse import parse_qs
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from .stub_server import start_server
+
+# Smallest valid GIF, returned for evidence thumbnails.
+THUMBNAIL = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01'
+    b'\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+
+class FakeWBIA:
+    def __init__(
+        self,
+        latency=0.0,
+        detection_duration=1.0,
+        classification_duration=1.0,
+        identification_duration=2.0,
+        annotations_per_image=3,
+        image_size=(1920, 1080),
+        error_rate=0.0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.durations = {
+            'detection': detection_duration,
+            'classification': classification_duration,
+            'identification': identification_duration,
+        }
+        self.annotations_per_image = annotations_per_image
+        self.image_size = list(image_size)
+        self.requests = 0
+        self.jobs_started = 0
+        self._gids = itertools.count(1)
+        self._image_uuids = {}
+        self._jobs = {}
+
+    def app(self):
+        return Starlette(
+            routes=[
+                Route('/api/upload/image/', self.upload_image, methods=['POST']),
+                Route('/api/image/uuid/', self.image_uuid),
+                Route('/api/image/size/', self.image_size_route),
+                Route('/api/engine/detect/cnn/lightnet/', self.detect, methods=['POST']),
+                Route('/api/engine/labeler/cnn/', self.classify, methods=['POST']),
+                Route(
+                    '/api/engine/review/query/chip/best/', self.identify, methods=['POST']
+                ),
+                Route('/api/engine/job/status/', self.job_status),
+                Route('/api/engine/job/result/', self.job_result),
+                Route('/api/query/graph/match/thumb/', self.thumbnail),
+            ]
+        )
+
+    async def _respond(self, response):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return Response(b'Bad Gateway', status_code=502)
+        return JSONResponse({'status': {'success': True}, 'response': response})
+
+    async def _form(self, request):
+        body = (await request.body()).decode()
+        return {key: json.loads(values[0]) for key, values in parse_qs(body).items()}
+
+    def _start_job(self, kind, result):
+        jobid = uuid.uuid4().hex
+        self.jobs_started += 1
+        self._jobs[jobid] = (time.monotonic() + self.durations[kind], result)
+        return jobid
+
+    async def upload_image(self, request):
+        await request.body()
+        gid = next(self._gids)
+        self._image_uuids[gid] = str(uuid.uuid4())
+        return await self._respond(gid)
+
+    async def image_uuid(self, request):
+        gids = [int(gid) for gid in request.query_params.getlist('gid_list')]
+        return await self._respond([{'__UUID__': self._image_uuids.get(gid)} for gid in gids])
+
+    async def image_size_route(self, request):
+        gids = request.query_params.getlist('gid_list')
+        return await self._respond([self.image_size for _gid in gids])
+
+    async def detect(self, request):
+        form = await self._form(request)
+        results_list = []
+        for _image in form['image_uuid_list']:
+            width, height = self.image_size
+            results_list.append(
+                [
+                    {
+                        'id': index + 1,
+                        'uuid': {'__UUID__': str(uuid.uuid4())},
+                        'xtl': random.randint(0, width // 2),
+                        'ytl': random.randint(0, height // 2),
+                        'width': width // 4,
+                        'height': height // 4,
+                        'theta': 0.0,
+                        'confidence': random.random(),
+                    }
+                    for index in range(self.annotations_per_image)
+                ]
+            )
+        jobid = self._start_job('detection', {'results_list': results_list})
+        return await self._respond(jobid)
+
+    async def classify(self, request):
+        form = await self._form(request)
+        result = [
+            {
+                'annot_uuid': annot['__UUID__'],
+                'score': random.random(),
+                'species_nice': 'Plains zebra',
+                'viewpoint_nice': random.choice(['Left', 'Right', 'Front', 'Back']),
+            }
+            for annot in form['annot_uuid_list']
+        ]
+        return await self._respond(self._start_job('classification', result))
+
+    async def identify(self, request):
+        form = await self._form(request)
+        result = {
+            'extern': {
+                'reference': uuid.uuid4().hex[:16],
+                'qannot_uuid': form['annot_uuid']['__UUID__'],
+                'dannot_uuid': str(uuid.uuid4()),
+            }
+        }
+        return await self._respond(self._start_job('identification', result))
+
+    async def job_status(self, request):
+        job = self._jobs.get(request.query_params.get('jobid'))
+        if job is None:
+            status = 'unknown'
+        else:
+            status = 'completed' if time.monotonic() >= job[0] else 'working'
+        return await self._respond({'jobstatus': status})
+
+    async def job_result(self, request):
+        _finish_at, result = self._jobs[request.query_params['jobid']]
+        return await self._respond({'json_result': result})
+
+    async def thumbnail(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return Response(THUMBNAIL, media_type='image/gif')
+
+
+async def serve_forever(args):
+    fake = FakeWBIA(
+        latency=args.latency,
+        detection_duration=args.job_duration,
+        classification_duration=args.job_duration,
+        identification_duration=args.job_duration,
+        error_rate=args.error_rate,
+    )
+    server, task = await start_server(fake.app(), port=args.port)
+    print(f'Fake WBIA listening on http://127.0.0.1:{args.port}')
+    await task
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--job-duration', type=float, default=1.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    asyncio.run(serve_forever(parser.parse_args()))
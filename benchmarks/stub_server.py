@@ -0,0 +1,52 @@
+import asyncio
+import itertools
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+def create_stub_app(latency=0.0):
+    gids = itertools.count(1)
+
+    def respond(response):
+        return JSONResponse({'status': {'success': True}, 'response': response})
+
+    async def upload_image(request):
+        await request.body()
+        await asyncio.sleep(latency)
+        return respond(next(gids))
+
+    async def image_uuid(request):
+        await asyncio.sleep(latency)
+        return respond([{'__UUID__': f'00000000-0000-0000-0000-{1:012d}'}])
+
+    async def image_size(request):
+        await asyncio.sleep(latency)
+        return respond([[1920, 1080]])
+
+    return Starlette(
+        routes=[
+            Route('/api/upload/image/', upload_image, methods=['POST']),
+            Route('/api/image/uuid/', image_uuid),
+            Route('/api/image/size/', image_size),
+        ]
+    )
+
+
+async def start_server(app, host='127.0.0.1', port=5005):
+    server = uvicorn.Server(
+        uvicorn.Config(app, host=host, port=port, log_level='warning', lifespan='off')
+    )
+    task = asyncio.ensure_future(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def stop_server(server, task):
+    server.should_exit = True
+    await task
@@ -1,23 +1,29 @@
-from datetime import datetime
+import logging
+import time
 
 from h2o_wave import Q, app, main, ui  # noqa: F401
 
 from sage_identification_pipeline import GLOBAL_HANDLERS
 
 from . import handlers  # noqa: F401 Need to import to register the handlers
-from .initializers import initialize_app, initialize_client, initialize_user
+from .common import forget_rendered_cards
+from .logs import configure_logging
+from .metrics import serve_seconds
+from .initializers import initialize_app, initialize_client, initialize_user, shutdown_app
 from .wave_utils import (
-    print_q_args,
+    log_q_args,
     ui_crash_card,
 )
 
+configure_logging()
+logger = logging.getLogger(__name__)
 
-@app('/', mode='multicast')
+
+@app('/', mode='unicast', on_shutdown=shutdown_app)
 async def serve(q: Q):
-    print('Enter serve')
-    before = datetime.now()
+    before = time.monotonic()
 
-    print_q_args(q.args)
+    log_q_args(q.args)
 
     try:
         del q.page['crash_card']
@@ -32,7 +38,9 @@ async def serve(q: Q):
             await q.page.save()
 
     except Exception as unknown_exception:
+        logger.exception('Unhandled error in serve')
         q.page.drop()
+        forget_rendered_cards(q)
         await ui_crash_card(
             q,
             app_name='WBIA Identification Pipeline',
@@ -42,4 +50,6 @@ async def serve(q: Q):
             path='https://github.com/WildMeOrg/sage-identification-pipeline',
         )
 
-    print(f'Time in serve(ms): {int((datetime.now() - before).microseconds/1000.0)}')
+    elapsed = time.monotonic() - before
+    serve_seconds.observe(elapsed)
+    logger.debug('Time in serve(ms): %.0f', elapsed * 1000)
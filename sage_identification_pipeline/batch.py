@@ -0,0 +1,159 @@
+"""Run the identification pipeline over a directory of images, without Wave.
+
+    python -m sage_identification_pipeline.batch IMAGE_DIR --output results.jsonl
+
+Every processed image is appended to the output as one JSON line as soon as
+it finishes. Re-running with the same output resumes: images that already
+completed are skipped, failed ones are retried.
+"""
+import argparse
+import asyncio
+import json
+import os
+import logging
+from dataclasses import asdict
+
+from .connections import close_client
+from .jobs import get_job_multiplexer
+from .logs import configure_logging
+from .metrics import dump_json
+from .preprocess import shutdown_preprocess_pool
+from .sage import execute_pipeline
+from .sage_client import get_sage_client
+from .scheduler import StageScheduler
+from .state import PIPELINE_STAGES, PipelineParams, PipelineRun
+from .utils import get_dirs_in_dir, get_files_in_dir, now
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png')
+
+logger = logging.getLogger(__name__)
+
+
+def find_images(dir_path, pattern='', extensions=IMAGE_EXTENSIONS, recursive=False):
+    images = []
+    for ext in extensions:
+        images.extend(get_files_in_dir(dir_path, pattern, ext))
+    if recursive:
+        for sub_dir in get_dirs_in_dir(dir_path):
+            images.extend(find_images(sub_dir, pattern, extensions, recursive))
+    return sorted(images)
+
+
+def completed_images(output_path):
+    completed = set()
+    if not os.path.isfile(output_path):
+        return completed
+    with open(output_path, 'r') as output_fp:
+        for line in output_fp:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A crash can leave a truncated last line behind.
+                continue
+            if record.get('status') == 'completed':
+                completed.add(record['image'])
+    return completed
+
+
+def run_record(image_path, run: PipelineRun, error=None):
+    return {
+        'image': image_path,
+        'status': 'failed' if error else 'completed',
+        'error': error,
+        'params': asdict(run.params),
+        'image_uuid': run.image_uuid,
+        'image_size': run.image_size,
+        'annotations': run.annotations,
+        'classifications': run.classification_results,
+        'identifications': run.identification_results,
+        'stage_durations': run.stage_durations,
+        'finished_at': now(),
+    }
+
+
+async def process_image(sage, image_path, params, scheduler, output_fp):
+    run = PipelineRun(target_image=image_path, params=params)
+    error = None
+    try:
+        await execute_pipeline(sage, run, image_path, scheduler=scheduler)
+    except Exception as exception:
+        logger.exception('Pipeline failed for %s', image_path)
+        error = str(exception) or type(exception).__name__
+    output_fp.write(json.dumps(run_record(image_path, run, error)) + '\n')
+    output_fp.flush()
+    return error is None
+
+
+async def run_batch(args):
+    images = find_images(
+        args.image_dir, args.pattern, args.extensions, recursive=args.recursive
+    )
+    images = [os.path.abspath(image) for image in images]
+    done = completed_images(args.output)
+    pending = [image for image in images if image not in done]
+    print(f'{len(images)} images found, {len(images) - len(pending)} already done')
+
+    params = PipelineParams(
+        detection_model_tag=args.detection_model_tag,
+        classification_model_tag=args.classification_model_tag,
+        sensitivity=args.sensitivity,
+        nms=args.nms,
+    )
+    # Image B uploads while image A is detecting, and so on.
+    scheduler = StageScheduler(
+        workers={stage: args.concurrency for stage in PIPELINE_STAGES}
+    )
+    sage = get_sage_client()
+    try:
+        with open(args.output, 'a') as output_fp:
+            outcomes = await asyncio.gather(
+                *[
+                    process_image(sage, image, params, scheduler, output_fp)
+                    for image in pending
+                ]
+            )
+    finally:
+        await scheduler.close()
+        await get_job_multiplexer().close()
+        await close_client()
+        shutdown_preprocess_pool()
+        if args.metrics_json:
+            dump_json(args.metrics_json)
+
+    failed = outcomes.count(False)
+    print(f'{len(outcomes) - failed} images completed, {failed} failed')
+    return failed
+
+
+def parse_args(argv=None):
+    defaults = PipelineParams()
+    parser = argparse.ArgumentParser(
+        prog='python -m sage_identification_pipeline.batch',
+        description='Run the WBIA identification pipeline over a directory of images.',
+    )
+    parser.add_argument('image_dir')
+    parser.add_argument('--output', default='results.jsonl')
+    parser.add_argument('--pattern', default='', help='substring image names must contain')
+    parser.add_argument('--extensions', nargs='+', default=list(IMAGE_EXTENSIONS))
+    parser.add_argument('--recursive', action='store_true')
+    parser.add_argument(
+        '--concurrency', type=int, default=4, help='images in flight per pipeline stage'
+    )
+    parser.add_argument('--detection-model-tag', default=defaults.detection_model_tag)
+    parser.add_argument(
+        '--classification-model-tag', default=defaults.classification_model_tag
+    )
+    parser.add_argument('--sensitivity', type=float, default=defaults.sensitivity)
+    parser.add_argument('--nms', type=float, default=defaults.nms)
+    parser.add_argument('--metrics-json', help='write the collected metrics to this file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    configure_logging()
+    failed = asyncio.run(run_batch(parse_args(argv)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
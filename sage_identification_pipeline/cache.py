@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import cache_requests
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Bounded key/value cache with least-recently-used eviction.
+
+    Entries optionally expire `ttl` seconds after they were stored. When a
+    `path` is given the cache is loaded from and saved to that JSON file, so
+    keys must be strings and values JSON-serializable. Inside an event loop,
+    the file is written at most every `save_delay` seconds on an executor
+    thread; call `flush` before the loop stops. Caches with a `name` count
+    their lookups in the cache_requests_total metric.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None, path=None, name=None, save_delay=1.0):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_delay = save_delay
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._dirty = False
+        self._save_task = None
+        self._save_loop = None
+        self._write_lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._live_entry(key) is not None
+
+    def _live_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, _value = entry
+        if expires_at is not None and expires_at < time.time():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        entry = self._live_entry(key)
+        if entry is None:
+            self.misses += 1
+            if self.name is not None:
+                cache_requests.inc(cache=self.name, result='miss')
+            return default
+        self.hits += 1
+        if self.name is not None:
+            cache_requests.inc(cache=self.name, result='hit')
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        if self.path is not None:
+            self._schedule_save()
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses}
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r') as cache_fp:
+                entries = json.load(cache_fp)
+        except (OSError, ValueError) as error:
+            logger.warning('Ignoring unreadable cache file %s: %s', self.path, error)
+            return
+        now = time.time()
+        for key, expires_at, value in entries[-self.max_entries :]:
+            if expires_at is None or expires_at >= now:
+                self._entries[key] = (expires_at, value)
+
+    def _snapshot(self):
+        return [[key, expires_at, value] for key, (expires_at, value) in self._entries.items()]
+
+    def _write(self, entries):
+        with self._write_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as cache_fp:
+                json.dump(entries, cache_fp)
+            os.replace(tmp_path, self.path)
+
+    def save(self):
+        self._dirty = False
+        self._write(self._snapshot())
+
+    def _schedule_save(self):
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self._save_task is None or self._save_task.done() or self._save_loop is not loop:
+            self._save_loop = loop
+            self._save_task = loop.create_task(self._save_later())
+
+    async def _save_later(self):
+        # Changes made while a write runs are saved by the next iteration.
+        while self._dirty:
+            await asyncio.sleep(self.save_delay)
+            await self._save_now()
+
+    async def _save_now(self):
+        self._dirty = False
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(None, self._write, self._snapshot())
+        except OSError as error:
+            logger.warning('Could not save cache file %s: %s', self.path, error)
+
+    async def flush(self):
+        """Writes pending changes now, off the event loop."""
+        task, self._save_task = self._save_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if self._dirty:
+            await self._save_now()
+
+def cache_key(*parts):
+    return json.dumps(parts, separators=(',', ':'))
@@ -5,6 +5,7 @@ from datetime import timedelta
 from typing import List, Tuple
 
 from h2o_wave import Q, site
+from h2o_wave.core import marshal
 
 from .components import (
     get_meta,
@@ -23,6 +24,10 @@ from .components import (
     get_footer,
 )
 
+from .metrics import timed, ui_cards, ui_render_seconds
+from .state import current_run, session_runs
+from .thumbnails import PREVIEW_VERSIONS, get_evidence_thumbnails
+
 from .utils import (
     download_file,
     now,
@@ -31,41 +36,75 @@ from .utils import (
 )
 
 
+def render_card(q: Q, name, card):
+    """Puts `card` on the page, unless this client already shows the same card.
+
+    Passing None removes the card. Unchanged cards send nothing to the Wave
+    server, so a render only ships the cards whose content changed.
+    """
+    rendered = q.client.rendered_cards
+    if rendered is None:
+        rendered = q.client.rendered_cards = {}
+    fingerprint = None if card is None else hash(marshal(card.dump()))
+    if rendered.get(name) == fingerprint:
+        ui_cards.inc(result='unchanged')
+        return
+    ui_cards.inc(result='sent')
+    if card is None:
+        del q.page[name]
+        del rendered[name]
+    else:
+        q.page[name] = card
+        rendered[name] = fingerprint
+
+
+def forget_rendered_cards(q: Q):
+    """Call after the page was cleared, so the next render puts every card."""
+    q.client.rendered_cards = {}
+
+
+@timed(ui_render_seconds)
 async def make_base_ui(q: Q):
-    q.page['meta'] = get_meta()
-    q.page['logo'] = get_logo(q)
-    q.page['title'] = get_title(q)
+    run = current_run(q)
+    session = session_runs(q)
+
+    render_card(q, 'meta', get_meta())
+    render_card(q, 'logo', get_logo(q))
+    render_card(q, 'title', get_title(q))
 
-    if (q.app.target_image):
-        q.page['target_image'] = get_target_image_display(q)
+    if run.target_image:
+        render_card(q, 'target_image', get_target_image_display(run, session))
     else:
-        q.page['target_image'] = get_target_image(q)
-    
-    q.page['action_card'] = get_action_card(q)
-    q.page['stepper'] = get_stepper(q)
-
-    if q.app.detection_in_progress:
-        q.page['detection_card'] = get_detection_progress_card(q)
-    elif q.app. detection_complete:
-        q.page['detection_card'] = get_detection_card(q)
+        render_card(q, 'target_image', get_target_image(q))
+
+    render_card(q, 'action_card', get_action_card(q, run, session))
+    render_card(q, 'stepper', get_stepper(run))
+
+    if run.detection_in_progress:
+        render_card(q, 'detection_card', get_detection_progress_card(run))
+    elif run.detection_complete:
+        render_card(q, 'detection_card', get_detection_card(run))
     else:
-        del q.page['detection_card']
+        render_card(q, 'detection_card', None)
 
-    if q.app.classification_in_progress:
-        q.page['classification_card'] = get_classification_progress_card(q)
-    elif q.app.classification_complete:
-        q.page['classification_card'] = get_classification_card(q)
+    if run.classification_in_progress:
+        render_card(q, 'classification_card', get_classification_progress_card(run))
+    elif run.classification_complete:
+        render_card(q, 'classification_card', get_classification_card(run))
     else:
-        del q.page['classification_card']
+        render_card(q, 'classification_card', None)
 
-    if q.app.identification_in_progress:
-        q.page['results_table'] = get_identification_in_progress(q)
-    elif q.app.identification_complete:
-        q.page['results_table'] = get_identification_results(q)
+    if run.identification_in_progress and not any(run.identification_results or []):
+        render_card(q, 'results_table', get_identification_in_progress(run))
+    elif run.identification_in_progress or run.identification_complete:
+        evidence_urls = await get_evidence_thumbnails().publish(
+            q.site, run.identification_results, PREVIEW_VERSIONS
+        )
+        render_card(q, 'results_table', get_identification_results(run, evidence_urls))
     else:
-        del q.page['results_table']
-    
-    q.page['footer'] = get_footer()
+        render_card(q, 'results_table', None)
+
+    render_card(q, 'footer', get_footer())
     await q.page.save()
 
 
@@ -75,8 +114,8 @@ def create_app_dirs(q: Q):
     os.makedirs(q.app.users_dir, exist_ok=True)
 
 
-def download_to_local_storage(q: Q, object_url):
-    file_path = download_file(
+async def download_to_local_storage(q: Q, object_url):
+    file_path = await download_file(
         q.args.object_url,
         os.path.join('.', os.path.basename(q.args.object_url)),
     )
@@ -1,10 +1,28 @@
+import asyncio
+import logging
 import os
 
 from h2o_wave import Q, ui, graphics as g
 
+from .config import ASSET_WAIT_TIMEOUT, WBIA_API_PREFIX
 from .layouts import get_layouts
+from .sage_client import get_sage_client
+from .state import RUN_CANCELLED, RUN_FAILED, RUN_IDLE, PipelineRun, current_run
+from .tasks import pipeline_tasks
+from .thumbnails import get_evidence_thumbnails
 from .wave_utils import WaveColors
-from .constants import detection_model_tags, classification_model_tags
+from .constants import (
+    classification_model_tags,
+    default_classification_model_tag,
+    default_detection_model_tag,
+    default_nms,
+    default_sensitivity,
+    detection_model_tags,
+)
+
+
+logger = logging.getLogger(__name__)
+
 
 def get_meta(side_panel=False):
     return ui.meta_card(
@@ -14,9 +32,11 @@ def get_meta(side_panel=False):
     )
 
 def get_logo(q: Q):
+    # The logo is published in the background at startup.
+    caption = f'![wild me logo]({q.app.logo_path})' if q.app.logo_path else 'Wild Me'
     return ui.footer_card(
         box='header',
-        caption=f'![wild me logo]({q.app.logo_path})'
+        caption=caption
     )
 
 def get_title(q: Q):
@@ -36,7 +56,7 @@ def get_target_image(q: Q):
             ui.text('WBIA will process the target image using pre-trained image analysis models. The detection model attempts to draw a box around each individual in the target image. The classification model vets the boxes (annotations) for quality. The identification model compares each annotation to our database of individuals to try to find matches.'),
             ui.button(
                 name='open_upload_image_dialog',
-                label='Upload target image',
+                label='Upload target images',
                 primary=True,
             ),
             ui.button(
@@ -46,20 +66,40 @@ def get_target_image(q: Q):
         ],
     )
 
-def get_target_image_display(q: Q):
+def get_run_label(index, run: PipelineRun):
+    label = f'{index + 1}. {os.path.basename(run.target_image)}'
+    if run.status == RUN_IDLE:
+        return label
+    return f'{label} ({run.status})'
+
+def get_session_picker(run: PipelineRun, session):
+    return ui.dropdown(
+        name='selected_run',
+        label=f'{len(session)} target images',
+        value=run.run_id,
+        choices=[
+            ui.choice(name=x.run_id, label=get_run_label(index, x))
+            for index, x in enumerate(session)
+        ],
+        trigger=True,
+    )
+
+def get_target_image_display(run: PipelineRun, session):
+    picker = [get_session_picker(run, session)] if len(session) > 1 else []
     return ui.form_card(
         box='left',
         title='Target image',
         items=[
             ui.text(content=''), # margin top hack
-            ui.text(content=f'![target image]({q.app.target_image})'),
+            *picker,
+            ui.text(content=f'![target image]({run.target_image})'),
             ui.button(name="reset_target_image", label="Reset target image")
         ],
     )
 
-def get_action_card(q: Q):
-    sliderNms = q.args.nms if 'nms' in q.args else 0.4
-    sliderSensitivity = q.args.sensitivity if 'sensitivity' in q.args else 0.4
+def get_action_card(q: Q, run: PipelineRun, session):
+    sliderNms = q.args.nms if 'nms' in q.args else default_nms
+    sliderSensitivity = q.args.sensitivity if 'sensitivity' in q.args else default_sensitivity
 
     return ui.form_card(
         box='right',
@@ -69,14 +109,14 @@ def get_action_card(q: Q):
                 name='detection_model_tag',
                 label='Detection model tag',
                 choices=[ui.choice(name=x, label=x) for x in detection_model_tags],
-                value='ggr2',
+                value=default_detection_model_tag,
                 tooltip='The detection model is used to identify annotations in the target image (draw boxes around animals).',
             ),
             ui.dropdown(
                 name='classification_model_tag',
                 label='Classification model tag',
                 choices=[ui.choice(name=x, label=x) for x in classification_model_tags],
-                value='zebra_v1',
+                value=default_classification_model_tag,
                 tooltip='The classification model is used to label the annotations with species, viewpoint, and confidence score.',
             ),
             ui.slider(
@@ -97,32 +137,74 @@ def get_action_card(q: Q):
                 step=0.01,
                 tooltip='Non-maximal suppression attempts to de-duplicate overlapping annotations of the same animal.',
             ),
-            ui.button(name='run', label='Run identification pipeline', primary=True, disabled=not q.app.target_image or q.app.running_pipeline),
+            ui.button(
+                name='run',
+                label='Run identification pipeline' if len(session) == 1 else f'Run identification pipeline on {len(session)} images',
+                primary=True,
+                disabled=not run.target_image or any(x.running for x in session),
+            ),
+            *get_run_status_items(run),
         ],
     )
 
 
-def get_stepper(q: Q):
+def get_run_status_items(run: PipelineRun):
+    if run.running:
+        return [ui.button(name='cancel_run', label='Cancel run')]
+    if run.status == RUN_CANCELLED:
+        return [ui.message_bar(type='warning', text='The pipeline run was cancelled.')]
+    if run.status == RUN_FAILED:
+        return [ui.message_bar(type='error', text=f'The pipeline run failed: {run.error}')]
+    return []
+
+
+def get_step_label(run: PipelineRun, label, stage):
+    duration = run.stage_durations.get(stage)
+    if duration is None:
+        return label
+    return f'{label} ({duration:.1f}s)'
+
+def get_stepper(run: PipelineRun):
     return ui.form_card(
         box='results',
         items=[
             ui.stepper(
                 name='pipeline-stepper',
                 items=[
-                    ui.step(label='Upload', icon='CloudUpload', done=bool(q.app.upload_complete)),
-                    ui.step(label='Detection', icon='BuildQueueNew', done=bool(q.app.detection_complete)),
-                    ui.step(label='Classification', icon='Compare', done=bool(q.app.classification_complete)),
-                    ui.step(label='Identification', icon='BranchCompare', done=bool(q.app.identification_complete)),
+                    ui.step(label=get_step_label(run, 'Upload', 'upload'), icon='CloudUpload', done=run.upload_complete),
+                    ui.step(label=get_step_label(run, 'Detection', 'detection'), icon='BuildQueueNew', done=run.detection_complete),
+                    ui.step(label=get_step_label(run, 'Classification', 'classification'), icon='Compare', done=run.classification_complete),
+                    ui.step(label=get_step_label(run, 'Identification', 'identification'), icon='BranchCompare', done=run.identification_complete),
                 ],
             )
         ],
     )
 
-def get_detection_progress_card(q: Q):
+def get_stage_caption(run: PipelineRun, stage):
+    """E.g. 'Job working · 12s elapsed · 4 status checks'."""
+    if run.queued_stage == stage:
+        return f'Waiting for a free {stage} worker...'
+    progress = run.stages.get(stage)
+    if progress is None:
+        return 'Working...'
+    statuses = progress.job_statuses()
+    if len(progress.jobs) == 1:
+        parts = [f'Job {next(iter(statuses))}']
+    else:
+        parts = [f'{count} {status}' for status, count in statuses.items()]
+    parts.append(f'{progress.elapsed:.0f}s elapsed')
+    if progress.attempts:
+        parts.append(f'{progress.attempts} status checks')
+    return ' · '.join(parts)
+
+def get_detection_progress_card(run: PipelineRun):
     return ui.form_card(
         box='detection',
         items=[
-            ui.progress(label='Detection in progress', caption='Working...')
+            ui.progress(
+                label='Detection in progress',
+                caption=get_stage_caption(run, 'detection'),
+            )
         ]
     )
 
@@ -137,21 +219,21 @@ def get_rect(annotation):
         stroke_width='2px'
     )
 
-def get_detection_card(q: Q):
-    if 'annotations' in q.app and bool(q.app.annotations):
+def get_detection_card(run: PipelineRun):
+    if run.annotations:
         card_padding = 30 # inferred from DOM
         card_width = 386 # inferred from DOM
         svg_width = card_width - card_padding
-        svg_height = svg_width * q.app.image_size[1] / q.app.image_size[0] 
+        svg_height = svg_width * run.image_size[1] / run.image_size[0] 
         card_height = svg_height + card_padding
 
         return ui.graphics_card(
             box= ui.box(zone='detection',
             height=f'{card_height}px'),
-            view_box=f'0 0 {q.app.image_size[0]} {q.app.image_size[1]}', height=f'{svg_height}px', width=f'{svg_width}px',
+            view_box=f'0 0 {run.image_size[0]} {run.image_size[1]}', height=f'{svg_height}px', width=f'{svg_width}px',
             stage=g.stage(
-                target = g.image(x='0', y='0', width=f'{q.app.image_size[0]}', height=f'{q.app.image_size[1]}', href=q.app.target_image),
-                **{a['uuid']: get_rect(a) for a in q.app.annotations},
+                target = g.image(x='0', y='0', width=f'{run.image_size[0]}', height=f'{run.image_size[1]}', href=run.target_image),
+                **{a['uuid']: get_rect(a) for a in run.annotations},
             )
         )
     else:
@@ -164,19 +246,22 @@ def get_detection_card(q: Q):
         )
 
 
-def get_classification_progress_card(q: Q):
+def get_classification_progress_card(run: PipelineRun):
     return ui.form_card(
         box='classification',
         items=[
-            ui.progress(label='Classification in progress', caption='Working...')
+            ui.progress(
+                label='Classification in progress',
+                caption=get_stage_caption(run, 'classification'),
+            )
         ]
     )
 
-def get_classification_card(q: Q):    
-    if 'classification_results' in q.app and bool(q.app.classification_results):
+def get_classification_card(run: PipelineRun):
+    if run.classification_results:
         items = [ui.label(label='Classification results')]
         i = 1
-        for a in q.app.classification_results:
+        for a in run.classification_results:
             score = a['score']
             species = a['species_nice']
             viewpoint = a['viewpoint_nice']
@@ -226,44 +311,59 @@ def get_results_columns():
     return columns
 
 
-def get_identification_in_progress(q: Q):
+def get_identification_progress(run: PipelineRun):
+    caption = get_stage_caption(run, 'identification')
+    total = len(run.identification_results or [])
+    if not total:
+        return ui.progress(label='Identification in progress', caption=caption)
+    done = run.identification_done
+    return ui.progress(
+        label='Identification in progress',
+        caption=f'{done} of {total} annotations identified · {caption}',
+        value=done / total,
+    )
+
+
+def get_identification_in_progress(run: PipelineRun):
     return ui.form_card(
         box='identification',
         items=[
-            ui.progress(label='Identification in progress', caption='This step can take a long time...')
+            get_identification_progress(run)
         ]
     )
 
-def get_identification_results(q: Q):
-    if 'identification_results' in q.app and bool(q.app.identification_results):
-        clean_identification_results = [r for r in q.app.identification_results if r]
-        items = [ui.label(label='Identification results')]
-        i = 1
-        for result in clean_identification_results:
-            cleanUrl = generate_evidence_url(
-                result['reference'], result['qannot_uuid'], result['dannot_uuid'], 'clean'
-            )
-            matchesUrl = generate_evidence_url(
-                result['reference'], result['qannot_uuid'], result['dannot_uuid'], 'matches'
-            )
-            heatmaskUrl = generate_evidence_url(
-                result['reference'], result['qannot_uuid'], result['dannot_uuid'], 'heatmask'
-            )
+def get_evidence_url(result, version, evidence_urls):
+    """Wave path of a cached evidence thumbnail, else its WBIA URL."""
+    url = evidence_urls.get(version)
+    if url is None:
+        url = generate_evidence_url(
+            result['reference'], result['qannot_uuid'], result['dannot_uuid'], version
+        )
+    return url
 
+def get_identification_results(run: PipelineRun, evidence_urls=None):
+    if any(run.identification_results or []):
+        items = [ui.label(label='Identification results')]
+        if run.identification_in_progress:
+            items.append(get_identification_progress(run))
+        for i, result in enumerate(run.identification_results, 1):
+            if not result:
+                continue
+            result_urls = evidence_urls[i - 1] if evidence_urls else {}
+            cleanUrl = get_evidence_url(result, 'clean', result_urls)
+
+            # Heatmask and matches evidence are loaded by the candidate dialog.
             items.append(ui.separator(label=f'Annotation {i}'))
-            items.append(ui.text_s(f'Best match with no evidence'))
-            items.append(ui.text(
-                content=f'![target image with candidate image and heatmap]({cleanUrl})'
-            ))
-            items.append(ui.text_s(f'Best match with heatmask evidence'))
+            items.append(ui.text_s('Best match'))
             items.append(ui.text(
-                content=f'![target image with candidate image and heatmap]({heatmaskUrl})'
+                content=f'![target image with candidate image]({cleanUrl})'
             ))
-            items.append(ui.text_s(f'Best match with detailed evidence'))
-            items.append(ui.text(
-                content=f'![target image with candidate image and heatmap]({matchesUrl})'
+            items.append(ui.button(
+                name='results_table',
+                label='Show evidence',
+                value=str(i - 1),
+                link=True,
             ))
-            i += 1
 
         items.append(ui.text(
             content='Using your own wildlife images? Researchers would appreciate it if you would report them to the appropriate [Wildbook](https://wildme.org/#/platforms)!'
@@ -314,58 +414,97 @@ def get_footer():
 def generate_evidence_url(
     extern_reference, query_annot_uuid, database_annot_uuid, version
 ):
-    api_prefix = 'https://demo.dyn.wildme.io'
-    return f'{api_prefix}/api/query/graph/match/thumb/?extern_reference={extern_reference}&query_annot_uuid={query_annot_uuid}&database_annot_uuid={database_annot_uuid}&version={version}'
+    return f'{WBIA_API_PREFIX}/api/query/graph/match/thumb/?extern_reference={extern_reference}&query_annot_uuid={query_annot_uuid}&database_annot_uuid={database_annot_uuid}&version={version}'
 
 
-async def make_candidate_dialog(q: Q):
-    extern_reference = 'angmvnjtzxbhuhta'
-    query_annot_uuid = 'df1fde83-ff93-468b-be52-e7a94b48ef9a'
-    database_annot_uuid = '5e494777-bf4d-485e-8c29-1026111b48b0'
+def get_candidate_index(q: Q):
+    # A button sends the annotation index; a table row click sends a list.
+    value = q.args.results_table
+    if isinstance(value, list):
+        value = value[0] if value else None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-    cleanUrl = generate_evidence_url(
-        extern_reference, query_annot_uuid, database_annot_uuid, 'clean'
-    )
-    matchesUrl = generate_evidence_url(
-        extern_reference, query_annot_uuid, database_annot_uuid, 'matches'
-    )
-    heatmaskUrl = generate_evidence_url(
-        extern_reference, query_annot_uuid, database_annot_uuid, 'heatmask'
-    )
+
+async def make_candidate_dialog(q: Q):
+    run = current_run(q)
+    results = run.identification_results or []
+    index = get_candidate_index(q)
+    if index is None or not 0 <= index < len(results) or not results[index]:
+        return
+    result = results[index]
+    title = f'Annotation {index + 1}: identification candidate'
 
     q.page['meta'].dialog = None
     await q.page.save()
-    q.page['meta'].dialog = ui.dialog(
-        title='Identification candidate',
-        closable=True,
+    # Closing the dialog or opening another candidate makes a pending load stale.
+    dialog_id = object()
+    q.client.candidate_dialog = dialog_id
+    q.page['meta'].dialog = candidate_dialog(title, result, None)
+    await q.page.save()
+    pipeline_tasks.start_background(load_candidate_evidence(q, dialog_id, title, result))
+
+
+async def load_candidate_evidence(q: Q, dialog_id, title, result):
+    evidence = get_evidence_thumbnails()
+    try:
+        await evidence.prefetch(get_sage_client(), result)
+        evidence_urls = (await evidence.publish(q.site, [result]))[0]
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception('Loading evidence thumbnails failed')
+        evidence_urls = {}
+    if q.client.candidate_dialog is not dialog_id:
+        return
+    q.page['meta'].dialog = candidate_dialog(title, result, evidence_urls)
+    await q.page.save()
+
+
+def candidate_dialog(title, result, evidence_urls):
+    """Evidence dialog for a candidate; without `evidence_urls` the images show as loading.
+
+    The loading dialog can only be closed with its Close button, which the
+    close_dialog handler sees, so the loaded dialog never reopens it.
+    """
+
+    def evidence_image(version, alt):
+        if evidence_urls is None:
+            return ui.progress(label='Loading evidence')
+        url = get_evidence_url(result, version, evidence_urls)
+        return ui.text(content=f'![{alt}]({url})')
+
+    return ui.dialog(
+        title=title,
+        closable=evidence_urls is not None,
         items=[
             ui.text(content='Target image with candidate match'),
-            ui.text(content=f'![target image with candidate image]({cleanUrl})'),
+            evidence_image('clean', 'target image with candidate image'),
             ui.text(content='Hotspotter markup'),
-            ui.text(
-                content=f'![target image with candidate image and hotspotter markup]({matchesUrl})'
+            evidence_image(
+                'matches', 'target image with candidate image and hotspotter markup'
             ),
             ui.text(content='Hotspotter heatmap'),
-            ui.text(
-                content=f'![target image with candidate image and heatmap]({heatmaskUrl})'
-            ),
+            evidence_image('heatmask', 'target image with candidate image and heatmap'),
             ui.button(name='close_dialog', label='Close', primary=True),
             ui.button(name='close_dialog', label='Close', primary=True),
             # Note: wave seems to be ignoring the last item in this list, hence the duplicate item.
         ],
     )
-    await q.page.save()
 
 async def make_upload_image_dialog(q: Q):
     q.page['meta'].dialog = None
     await q.page.save()
     q.page['meta'].dialog = ui.dialog(
-        title='Upload target image',
+        title='Upload target images',
         closable=True,
         items=[
             ui.file_upload(
                 name='target_image_upload',
                 label='Upload',
+                multiple=True,
                 file_extensions=['jpg', 'png', 'jpeg'],
                 height='180px',
             ),
@@ -374,11 +513,30 @@ async def make_upload_image_dialog(q: Q):
         ]
     )
 
+async def wait_for_assets(q: Q):
+    if q.app.assets is None or q.app.assets.done():
+        return
+    q.page['meta'].dialog = ui.dialog(
+        title='Loading example images',
+        closable=True,
+        items=[
+            ui.progress(label='Uploading example images'),
+            ui.progress(label='Uploading example images'),
+        ],
+    )
+    await q.page.save()
+    try:
+        await asyncio.wait_for(asyncio.shield(q.app.assets), ASSET_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+
+
 async def make_example_image_dialog(q: Q):
     q.page['meta'].dialog = None
     await q.page.save()
+    await wait_for_assets(q)
 
-    if 'example_images' in q.app:
+    if q.app.example_images:
         q.page['meta'].dialog = ui.dialog(
             title='Select example image',
             closable=True,
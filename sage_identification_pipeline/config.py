@@ -0,0 +1,150 @@
+import os
+
+WBIA_API_PREFIX = os.getenv('SAGE_WBIA_API_PREFIX', 'https://demo.dyn.wildme.io')
+
+# Wave server whose file store holds uploaded images; the same variables the
+# h2o_wave package reads, so images are streamed with the app's credentials.
+WAVE_ADDRESS = os.getenv('H2O_WAVE_ADDRESS', 'http://127.0.0.1:10101')
+WAVE_ACCESS_KEY_ID = os.getenv('H2O_WAVE_ACCESS_KEY_ID', 'access_key_id')
+WAVE_ACCESS_KEY_SECRET = os.getenv('H2O_WAVE_ACCESS_KEY_SECRET', 'access_key_secret')
+
+# Maximum number of identification jobs in flight for a single pipeline run.
+IDENTIFICATION_CONCURRENCY = int(os.getenv('SAGE_IDENTIFICATION_CONCURRENCY', '4'))
+
+# Interval of the shared job multiplexer; all due status checks of a tick are
+# sent together, so status traffic scales with this rate, not with job count.
+JOB_POLL_TICK = float(os.getenv('SAGE_JOB_POLL_TICK', '1.0'))
+
+# Process-wide HTTP client (connections.py). HTTP/2 is only used when the
+# optional `h2` package is installed (the http2 extra, or pip install h2).
+HTTP_MAX_CONNECTIONS = int(os.getenv('SAGE_HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('SAGE_HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('SAGE_HTTP_KEEPALIVE_EXPIRY', '30.0'))
+HTTP_HTTP2 = os.getenv('SAGE_HTTP_HTTP2', '1') == '1'
+HTTP_TIMEOUT = float(os.getenv('SAGE_HTTP_TIMEOUT', '30.0'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('SAGE_HTTP_CONNECT_TIMEOUT', '10.0'))
+HTTP_CONNECT_RETRIES = int(os.getenv('SAGE_HTTP_CONNECT_RETRIES', '2'))
+
+# Per-endpoint read timeouts of WBIA calls, in seconds: image uploads, calls
+# that start engine jobs, and the quick lookups (image info, job results).
+HTTP_UPLOAD_TIMEOUT = float(os.getenv('SAGE_HTTP_UPLOAD_TIMEOUT', '120.0'))
+HTTP_JOB_START_TIMEOUT = float(os.getenv('SAGE_HTTP_JOB_START_TIMEOUT', '30.0'))
+HTTP_QUERY_TIMEOUT = float(os.getenv('SAGE_HTTP_QUERY_TIMEOUT', '15.0'))
+
+# Retries of failed WBIA calls (resilience.py). Lookups are retried on any
+# transport error, 429 or 502-504; uploads and job starts only when the
+# request never reached WBIA, so a retry cannot start a second job.
+RETRY_ATTEMPTS = int(os.getenv('SAGE_RETRY_ATTEMPTS', '3'))
+RETRY_INITIAL_DELAY = float(os.getenv('SAGE_RETRY_INITIAL_DELAY', '0.5'))
+RETRY_MAX_DELAY = float(os.getenv('SAGE_RETRY_MAX_DELAY', '5.0'))
+
+# After this many consecutive WBIA failures, calls fail fast for
+# BREAKER_RESET_TIMEOUT seconds before a single trial call is let through.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('SAGE_BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RESET_TIMEOUT = float(os.getenv('SAGE_BREAKER_RESET_TIMEOUT', '30.0'))
+
+# Local directory for everything the app persists between restarts.
+APP_DATA_DIR = os.path.abspath(os.getenv('SAGE_APP_DATA_DIR', './app-data'))
+
+# Static assets (logo, example images) are published to the Wave file store in
+# the background at startup. The manifest records the digest and Wave path of
+# every published file, so unchanged files are not uploaded again on restart.
+ASSET_MANIFEST_PATH = os.path.join(APP_DATA_DIR, 'asset_manifest.json')
+ASSET_UPLOAD_CONCURRENCY = int(os.getenv('SAGE_ASSET_UPLOAD_CONCURRENCY', '4'))
+# How long the example image dialog waits for the assets before giving up.
+ASSET_WAIT_TIMEOUT = float(os.getenv('SAGE_ASSET_WAIT_TIMEOUT', '30.0'))
+
+# Content-addressed cache of images already uploaded to WBIA (digest -> gid,
+# uuid, size). Persisted under APP_DATA_DIR unless disabled.
+UPLOAD_CACHE_MAX_ENTRIES = int(os.getenv('SAGE_UPLOAD_CACHE_MAX_ENTRIES', '1024'))
+UPLOAD_CACHE_TTL = float(os.getenv('SAGE_UPLOAD_CACHE_TTL', str(24 * 60 * 60)))
+UPLOAD_CACHE_PERSIST = os.getenv('SAGE_UPLOAD_CACHE_PERSIST', '1') == '1'
+
+# Images are streamed to WBIA in chunks of this size; images whose size the
+# Wave file store does not report are spooled to a temp file first.
+UPLOAD_CHUNK_SIZE = int(os.getenv('SAGE_UPLOAD_CHUNK_SIZE', str(256 * 1024)))
+# Images up to this size are spooled (in memory up to UPLOAD_CHUNK_SIZE, then
+# to a temp file) and hashed before they are uploaded, so content WBIA already
+# has under another URL is not sent again. Larger images are hashed while they
+# stream, after the upload.
+UPLOAD_HASH_FIRST_MAX_BYTES = int(
+    os.getenv('SAGE_UPLOAD_HASH_FIRST_MAX_BYTES', str(8 * 1024 * 1024))
+)
+UPLOAD_SPOOL_DIR = os.path.join(APP_DATA_DIR, 'tmp')
+
+# Optional downscaling of images larger than this many pixels on their long
+# side before upload (0 disables it). Needs Pillow (pip install pillow); the
+# re-encoding runs in a pool of PREPROCESS_WORKERS processes.
+PREPROCESS_MAX_DIMENSION = int(os.getenv('SAGE_PREPROCESS_MAX_DIMENSION', '0'))
+PREPROCESS_FORMAT = os.getenv('SAGE_PREPROCESS_FORMAT', 'JPEG').upper()
+PREPROCESS_QUALITY = int(os.getenv('SAGE_PREPROCESS_QUALITY', '85'))
+PREPROCESS_WORKERS = int(os.getenv('SAGE_PREPROCESS_WORKERS', '2'))
+
+# In-memory caches of detection results (per image) and classification
+# results (per annotation), keyed by their inputs so re-runs only pay for
+# stages whose inputs changed.
+DETECTION_CACHE_MAX_ENTRIES = int(os.getenv('SAGE_DETECTION_CACHE_MAX_ENTRIES', '256'))
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv('SAGE_CLASSIFICATION_CACHE_MAX_ENTRIES', '4096'))
+
+# Identification evidence thumbnails (thumbnails.py): fetched from WBIA once,
+# kept on disk up to THUMBNAIL_CACHE_MAX_BYTES (least recently used go first)
+# and served to browsers from the Wave file store.
+THUMBNAIL_CACHE_DIR = os.path.join(APP_DATA_DIR, 'thumbnails')
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('SAGE_THUMBNAIL_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+THUMBNAIL_FETCH_CONCURRENCY = int(os.getenv('SAGE_THUMBNAIL_FETCH_CONCURRENCY', '8'))
+
+# Multi-image runs submit one detection job per DETECTION_BATCH_SIZE images.
+# Classification jobs take at most CLASSIFICATION_BATCH_SIZE annotations.
+DETECTION_BATCH_SIZE = int(os.getenv('SAGE_DETECTION_BATCH_SIZE', '50'))
+CLASSIFICATION_BATCH_SIZE = int(os.getenv('SAGE_CLASSIFICATION_BATCH_SIZE', '500'))
+
+# Optional warm-up (warmup.py): the pipeline runs on every example image at
+# default parameters at startup and then every WARMUP_INTERVAL seconds. Runs of
+# an example image with those parameters complete at once from the persisted
+# results.
+WARMUP_ENABLED = os.getenv('SAGE_WARMUP_ENABLED', '0') == '1'
+WARMUP_INTERVAL = float(os.getenv('SAGE_WARMUP_INTERVAL', str(6 * 60 * 60)))
+WARMUP_RESULTS_PATH = os.path.join(APP_DATA_DIR, 'cache', 'warm_results.json')
+
+# Run history (run_store.py): every finished pipeline run is recorded in an
+# SQLite database. A run of an image and parameters that completed less than
+# RUN_STORE_REUSE_MAX_AGE seconds ago is completed from it; 0 disables reuse.
+RUN_STORE_PATH = os.getenv('SAGE_RUN_STORE_PATH', os.path.join(APP_DATA_DIR, 'runs.sqlite3'))
+RUN_STORE_REUSE_MAX_AGE = float(os.getenv('SAGE_RUN_STORE_REUSE_MAX_AGE', str(24 * 60 * 60)))
+
+# Pipeline runs that are not running are evicted after this many idle
+# seconds, or oldest first once the registry holds this many runs.
+RUN_REGISTRY_TTL = float(os.getenv('SAGE_RUN_REGISTRY_TTL', '3600'))
+RUN_REGISTRY_MAX_RUNS = int(os.getenv('SAGE_RUN_REGISTRY_MAX_RUNS', '1000'))
+
+# Minimum interval between two progress renders of a running pipeline; job
+# status events in between are coalesced. Stage transitions render at once.
+PROGRESS_UPDATE_INTERVAL = float(os.getenv('SAGE_PROGRESS_UPDATE_INTERVAL', '1.0'))
+
+# Pipelines running in the background at the same time, across all clients.
+MAX_CONCURRENT_RUNS = int(os.getenv('SAGE_MAX_CONCURRENT_RUNS', '20'))
+
+# Stage scheduler (scheduler.py): every pipeline stage has its own pool of
+# workers, fed by a queue of at most STAGE_QUEUE_SIZE runs. A full queue
+# holds back the stage before it, down to submitting new runs.
+STAGE_WORKERS = {
+    'upload': int(os.getenv('SAGE_UPLOAD_WORKERS', '4')),
+    'detection': int(os.getenv('SAGE_DETECTION_WORKERS', '4')),
+    'classification': int(os.getenv('SAGE_CLASSIFICATION_WORKERS', '4')),
+    'identification': int(os.getenv('SAGE_IDENTIFICATION_WORKERS', '4')),
+}
+STAGE_QUEUE_SIZE = int(os.getenv('SAGE_STAGE_QUEUE_SIZE', '16'))
+
+# Prometheus text (/metrics) and JSON (/metrics.json) metrics endpoint; port 0
+# disables it. The app also writes a JSON dump to METRICS_DUMP_PATH on exit.
+METRICS_HOST = os.getenv('SAGE_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('SAGE_METRICS_PORT', '9464'))
+METRICS_DUMP_PATH = os.path.join(APP_DATA_DIR, 'metrics.json')
+
+# Logging (logs.py). Per-call debug logging of Sage calls and q.args is
+# sampled at LOG_SAMPLE_RATE and payloads are cut at LOG_MAX_FIELD_LENGTH.
+LOG_LEVEL = os.getenv('SAGE_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('SAGE_LOG_FORMAT', '%(asctime)s %(levelname)s %(name)s: %(message)s')
+LOG_SAMPLE_RATE = float(os.getenv('SAGE_LOG_SAMPLE_RATE', '0.1'))
+LOG_MAX_FIELD_LENGTH = int(os.getenv('SAGE_LOG_MAX_FIELD_LENGTH', '300'))
+LOG_QUEUE_SIZE = int(os.getenv('SAGE_LOG_QUEUE_SIZE', '10000'))
@@ -0,0 +1,77 @@
+import httpcore
+import httpx
+
+from .config import (
+    HTTP_CONNECT_RETRIES,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_HTTP2,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_TIMEOUT,
+    WAVE_ACCESS_KEY_ID,
+    WAVE_ACCESS_KEY_SECRET,
+    WAVE_ADDRESS,
+    WBIA_API_PREFIX,
+)
+
+_client = None
+_wave_client = None
+
+
+def http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_client(base_url=WBIA_API_PREFIX) -> httpx.AsyncClient:
+    # httpx only exposes keep-alive expiry and connect retries on the transport.
+    transport = httpcore.AsyncConnectionPool(
+        ssl_context=httpx.create_ssl_context(),
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        http2=HTTP_HTTP2 and http2_available(),
+        retries=HTTP_CONNECT_RETRIES,
+    )
+    return httpx.AsyncClient(
+        base_url=base_url,
+        transport=transport,
+        timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Returns the process-wide client shared by all Sage calls."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+
+def get_wave_client() -> httpx.AsyncClient:
+    """Returns the client for the Wave server's file store."""
+    global _wave_client
+    if _wave_client is None or _wave_client.is_closed:
+        # Authenticated like h2o_wave's own site client, which also skips TLS
+        # verification of the Wave server.
+        _wave_client = httpx.AsyncClient(
+            base_url=WAVE_ADDRESS,
+            auth=(WAVE_ACCESS_KEY_ID, WAVE_ACCESS_KEY_SECRET),
+            verify=False,
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+    return _wave_client
+
+
+async def close_client():
+    global _client, _wave_client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    if _wave_client is not None:
+        await _wave_client.aclose()
+        _wave_client = None
@@ -1,2 +1,8 @@
 from .model_tags import classification_model_tags, detection_model_tags
 from .example_images import example_images
+from .parameters import (
+    default_classification_model_tag,
+    default_detection_model_tag,
+    default_nms,
+    default_sensitivity,
+)
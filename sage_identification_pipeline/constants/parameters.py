@@ -0,0 +1,4 @@
+default_detection_model_tag = 'ggr2'
+default_classification_model_tag = 'zebra_v1'
+default_sensitivity = 0.4
+default_nms = 0.4
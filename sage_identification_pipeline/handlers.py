@@ -2,51 +2,131 @@ import os
 from typing import Any
 import asyncio
 import concurrent.futures
+import logging
+import sqlite3
 
 from h2o_wave import Q
 from h2o_wave.core import expando_to_dict
 from .wave_utils import clear_cards, handler
 from .components import make_candidate_dialog, make_example_image_dialog, make_upload_image_dialog
 from .common import make_base_ui
-from .sage import post_target_image, fetch_image_uuid, fetch_image_size, run_pipeline
-from .initializers import reset_pipeline_variables
+from .config import RUN_STORE_REUSE_MAX_AGE
+from .run_store import get_run_store
+from .sage import known_image_digest, run_pipeline, run_pipelines
+from .state import PipelineParams, session_runs, start_new_run, start_new_session
+from .tasks import RunCapacityError, pipeline_tasks
+from .warmup import find_warm_result
+
+logger = logging.getLogger(__name__)
 
 
 @handler()
 async def target_image_upload(q: Q):
     links = q.args.target_image_upload
     if links:
-        q.app.target_image = links[0]
+        start_new_session(q, links)
         q.page['meta'].dialog = None
         await make_base_ui(q)
 
 
+def run_switched(q: Q, arg_name: str) -> bool:
+    # The dropdown's value comes along with every submission; only act on changes.
+    value = getattr(q.args, arg_name)
+    return bool(value) and value != q.client.run_id
+
+
+@handler(qualifier=run_switched)
+async def selected_run(q: Q):
+    if q.args.selected_run in (q.client.session_run_ids or []):
+        q.client.run_id = q.args.selected_run
+    await make_base_ui(q)
+
+
+async def reusable_results(q: Q, pipeline_run):
+    result = await find_warm_result(q.app.example_images, pipeline_run)
+    if result is not None or RUN_STORE_REUSE_MAX_AGE <= 0:
+        return result
+    digest = known_image_digest(pipeline_run.target_image)
+    if digest is None:
+        return None
+    try:
+        return await get_run_store().latest_results(
+            digest, pipeline_run.params, RUN_STORE_REUSE_MAX_AGE
+        )
+    except sqlite3.Error as error:
+        logger.warning('Looking up earlier runs failed: %s', error)
+        return None
+
+
+async def run_session(q: Q, session):
+    """Completes the runs of `session` from reusable results or the pipeline.
+
+    Returns one exception or None per run, as execute_pipelines does.
+    """
+    pending = []
+    for pipeline_run in session:
+        # Warmed-up example images and recently run images complete at once.
+        result = await reusable_results(q, pipeline_run)
+        if result is None:
+            pending.append(pipeline_run)
+        else:
+            pipeline_run.restore(result)
+
+    errors = {}
+    if len(pending) == 1:
+        try:
+            await run_pipeline(q, pending[0])
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.exception('Pipeline run %s failed', pending[0].run_id)
+            errors[pending[0].run_id] = error
+    elif pending:
+        # Shared detection and classification jobs.
+        for pipeline_run, error in zip(pending, await run_pipelines(q, pending)):
+            errors[pipeline_run.run_id] = error
+    return [errors.get(pipeline_run.run_id) for pipeline_run in session]
+
+
 @handler()
 async def run(q: Q):
-    local_image_path = await q.site.download(q.app.target_image, '.')
-    q.app.running_pipeline = True
+    session = session_runs(q)
+    if any(pipeline_run.running for pipeline_run in session):
+        return
+    params = PipelineParams.from_args(q.args)
+    for pipeline_run in session:
+        pipeline_run.params = params
+        pipeline_run.reset_stages()
+    try:
+        # Started before the first await, so that a second click on Run sees
+        # the runs running; reusable results are looked up by the task.
+        pipeline_tasks.start_batch(
+            session,
+            run_session(q, session),
+            on_finished=lambda: make_base_ui(q),
+        )
+    except RunCapacityError as error:
+        q.page['meta'].notification = str(error)
+        await q.page.save()
+        return
     await make_base_ui(q)
 
-    await run_pipeline(q, local_image_path)
 
-    # await q.run(run_pipeline, q, local_image_path)
-
-    # with concurrent.futures.ThreadPoolExecutor() as pool:
-    #     await q.exec(pool, run_pipeline, q, local_image_path)
-    
+@handler()
+async def cancel_run(q: Q):
+    pipeline_tasks.cancel(q.client.run_id)
     await q.page.save()
 
 @handler()
 async def example_image_chosen(q: Q):
     q.page['meta'].dialog = None
-    q.app.target_image = q.args.example_image_selected
+    start_new_run(q, target_image=q.args.example_image_selected)
     await make_base_ui(q)
 
 @handler()
 async def reset_target_image(q: Q):
-    # await q.site.unload(q.app.target_image)
-    reset_pipeline_variables(q)
-    q.app.target_image = None
+    # await q.site.unload(run.target_image)
+    start_new_run(q)
     await make_base_ui(q)
 
 
@@ -68,5 +148,6 @@ async def results_table(q: Q):
 
 @handler()
 async def close_dialog(q: Q):
+    q.client.candidate_dialog = None
     q.page['meta'].dialog = None
     await q.page.save()
@@ -1,18 +1,49 @@
+import asyncio
+import logging
+
 from h2o_wave import Q
 
 from .common import create_app_dirs, make_base_ui
+from .config import HTTP_HTTP2, METRICS_DUMP_PATH, WBIA_API_PREFIX
+from .connections import close_client, get_client, http2_available
+from .jobs import get_job_multiplexer
+from .metrics import dump_json, start_metrics_server, stop_metrics_server
+from .preprocess import shutdown_preprocess_pool
+from .run_store import close_run_store
+from .sage import upload_cache
+from .sage_client import get_sage_client
+from .scheduler import get_stage_scheduler
+from .site_assets import publish_assets
 from .user import AppUser
 from .constants import example_images
+from .state import start_new_run
+from .tasks import pipeline_tasks
+from .thumbnails import get_evidence_thumbnails
+from .warmup import start_warm_up, stop_warm_up, warm_results
+
+LOGO_PATH = './sage_identification_pipeline/assets/logo.png'
+
+logger = logging.getLogger(__name__)
+
+
+async def publish_app_assets(q: Q):
+    """Publishes the logo and example images; unchanged files are not uploaded again."""
+    try:
+        wave_paths = await publish_assets(
+            q.site, [LOGO_PATH] + [image['path'] for image in example_images]
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception('Publishing the app assets failed')
+        wave_paths = {}
+    q.app.logo_path = wave_paths.get(LOGO_PATH)
+    q.app.example_images = [
+        dict(image, wave_path=wave_paths[image['path']])
+        for image in example_images
+        if wave_paths.get(image['path'])
+    ]
 
-def reset_pipeline_variables(q: Q):
-    q.app.running_pipeline = False
-    q.app.upload_complete = False
-    q.app.detection_in_progress = False
-    q.app.detection_complete = False
-    q.app.classification_in_progress = False
-    q.app.classification_complete = False
-    q.app.identification_in_progress = False
-    q.app.identification_complete = False
 
 async def initialize_app(q: Q):
     # Initialize only once per app instance
@@ -31,23 +62,40 @@ async def initialize_app(q: Q):
     # Perform all initialization specific to this app
     # await custom_app_init(q)
 
-    # Mark the app as initialized
+    # Mark the app as initialized before the first await, so that clients
+    # connecting meanwhile do not initialize it again
     q.app.initialized = True
-    reset_pipeline_variables(q)
-    q.app.api_prefix = 'https://demo.dyn.wildme.io'
+    q.app.api_prefix = WBIA_API_PREFIX
     q.app.multi_select_index = 5
     q.app.max_path_length = 60
 
-    print([image['path'] for image in example_images][0])
-    print('./sage_identification_pipeline/assets/logo.png')
-
-    logo_path_response = await q.site.upload(['./sage_identification_pipeline/assets/logo.png'])
-    q.app.logo_path = logo_path_response[0]
-
-    wave_paths = await q.site.upload([image['path'] for image in example_images])
-    for p, example_image in zip(wave_paths, example_images):
-        example_image.update({'wave_path': p})
-    q.app.example_images = example_images
+    # Open the pooled WBIA client shared by all pipeline runs
+    if HTTP_HTTP2 and not http2_available():
+        logger.warning(
+            'SAGE_HTTP_HTTP2 is on, but h2 is not installed (pip install h2); using HTTP/1.1'
+        )
+    get_client()
+
+    # Uploaded in the background, so the first request does not wait for them
+    q.app.assets = asyncio.ensure_future(publish_app_assets(q))
+    # Optional, see warmup.py
+    start_warm_up(get_sage_client())
+    await start_metrics_server()
+
+
+async def shutdown_app():
+    await stop_warm_up()
+    await pipeline_tasks.shutdown()
+    await close_run_store()
+    await get_stage_scheduler().close()
+    await get_evidence_thumbnails().close()
+    await upload_cache.flush()
+    await warm_results.flush()
+    await get_job_multiplexer().close()
+    await close_client()
+    shutdown_preprocess_pool()
+    await stop_metrics_server()
+    dump_json(METRICS_DUMP_PATH)
 
 
 async def initialize_user(q: Q):
@@ -78,6 +126,9 @@ async def initialize_client(q: Q):
     # q.client.selected_objects = None
     # q.client.wave_file_paths = None
 
+    # Every client starts with its own, empty pipeline run
+    start_new_run(q)
+
     # Crate the first view of the app
     await make_base_ui(q)
 
@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+
+import httpx
+
+from .config import HTTP_CONNECT_TIMEOUT, HTTP_QUERY_TIMEOUT, JOB_POLL_TICK
+from .connections import get_client
+from .metrics import job_seconds, job_status_checks, jobs_finished
+from .resilience import (
+    SageError,
+    SageUnavailableError,
+    get_circuit_breaker,
+    is_wbia_failure,
+)
+
+logger = logging.getLogger(__name__)
+
+# Reported to status listeners when a job was submitted, before any check.
+JOB_STATUS_QUEUED = 'queued'
+JOB_STATUS_COMPLETED = 'completed'
+JOB_STATUS_FAILED = ('exception', 'corrupted', 'suppressed')
+
+
+class JobError(SageError):
+    def __init__(self, job_id, message):
+        super().__init__(f'Job {job_id}: {message}')
+        self.job_id = job_id
+
+
+class JobFailedError(JobError):
+    def __init__(self, job_id, status):
+        super().__init__(job_id, f'finished with status {status!r}')
+        self.status = status
+
+
+class JobTimeoutError(JobError):
+    def __init__(self, job_id, timeout, attempts):
+        super().__init__(
+            job_id, f'not completed after {timeout:g}s ({attempts} attempts)'
+        )
+        self.timeout = timeout
+        self.attempts = attempts
+
+
+@dataclass(frozen=True)
+class PollPolicy:
+    # Delay before the first status check, in seconds.
+    initial_delay: float = 0.5
+    # Upper bound of the delay between two status checks.
+    max_delay: float = 10.0
+    # Growth factor applied to the delay after every unfinished attempt.
+    multiplier: float = 1.6
+    # Relative jitter so that jobs started together do not poll in lockstep.
+    jitter: float = 0.2
+    # Deadline for the whole job, measured from when it is submitted for polling.
+    timeout: float = 120.0
+
+    def next_delay(self, delay):
+        return min(delay * self.multiplier, self.max_delay)
+
+    def jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+DETECTION_POLL_POLICY = PollPolicy(timeout=120.0)
+CLASSIFICATION_POLL_POLICY = PollPolicy(timeout=120.0)
+IDENTIFICATION_POLL_POLICY = PollPolicy(initial_delay=2.0, max_delay=15.0, timeout=600.0)
+
+
+async def fetch_job_status(client, job_id):
+    result = await client.get(
+        '/api/engine/job/status/',
+        params={'jobid': job_id},
+        timeout=httpx.Timeout(HTTP_QUERY_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+    result.raise_for_status()
+    return result.json()
+
+
+class _PendingJob:
+    __slots__ = (
+        'job_id',
+        'policy',
+        'deadline',
+        'delay',
+        'next_poll',
+        'attempts',
+        'started_at',
+        'waiters',
+        'listeners',
+    )
+
+    def __init__(self, job_id, policy: PollPolicy, now):
+        self.job_id = job_id
+        self.policy = policy
+        self.deadline = now + policy.timeout
+        self.delay = policy.initial_delay
+        self.next_poll = now + policy.jittered(self.delay)
+        self.attempts = 0
+        self.started_at = now
+        self.waiters = []
+        self.listeners = []
+
+    def notify(self, status):
+        for listener in self.listeners:
+            try:
+                listener(self.job_id, status, self.attempts)
+            except Exception as error:
+                logger.warning('Status listener of job %s failed: %s', self.job_id, error)
+
+    def resolve(self, result=None, error=None):
+        for waiter in self.waiters:
+            if waiter.done():
+                continue
+            if error is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(result)
+
+
+class JobMultiplexer:
+    """Polls every outstanding WBIA job of the process from one background task.
+
+    Jobs keep their own backoff and deadline, but status checks only happen on
+    ticks, where all due jobs are checked together over one shared client.
+    WBIA has no batch status endpoint, so the checks of a tick are pipelined
+    concurrently instead. A tick counts against the circuit breaker as one
+    call; while it is open, due jobs are not checked but stay pending until
+    their deadline.
+    """
+
+    def __init__(self, tick_interval=JOB_POLL_TICK, client=None, breaker=None):
+        self.tick_interval = tick_interval
+        self.client = client
+        self.breaker = breaker
+        self._jobs = {}
+        self._task = None
+        self._wakeup = None
+
+    @property
+    def pending_jobs(self):
+        return len(self._jobs)
+
+    def _ensure_running(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def wait(self, job_id, policy: PollPolicy = PollPolicy(), on_status=None):
+        """Wait for a job to complete and return its status payload.
+
+        Raises JobFailedError or JobTimeoutError. Cancelling the awaiting task
+        only withdraws this waiter; the job is dropped once nobody waits on it.
+        `on_status(job_id, status, attempts)` is called from the polling task
+        after every status check, so it must not block.
+        """
+        if job_id is None:
+            raise JobFailedError(job_id, None)
+
+        self._ensure_running()
+        loop = asyncio.get_event_loop()
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = _PendingJob(job_id, policy, loop.time())
+            self._jobs[job_id] = job
+            self._wakeup.set()
+
+        waiter = loop.create_future()
+        job.waiters.append(waiter)
+        if on_status is not None:
+            job.listeners.append(on_status)
+        try:
+            return await waiter
+        finally:
+            job.waiters.remove(waiter)
+            if on_status is not None:
+                job.listeners.remove(on_status)
+            if not job.waiters and self._jobs.get(job_id) is job:
+                del self._jobs[job_id]
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for job in list(self._jobs.values()):
+            for waiter in job.waiters:
+                waiter.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            if not self._jobs:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await asyncio.sleep(self.tick_interval)
+
+            now = loop.time()
+            due = [job for job in self._jobs.values() if job.next_poll <= now]
+            if due:
+                await self._tick(due)
+
+    async def _tick(self, due):
+        loop = asyncio.get_event_loop()
+        breaker = self.breaker or get_circuit_breaker()
+        try:
+            trial = breaker.check()
+        except SageUnavailableError:
+            # WBIA is not called while the breaker is open; the jobs keep
+            # waiting for their next turn, up to their deadline.
+            now = loop.time()
+            for job in due:
+                self._reschedule(job, now)
+            return
+
+        if trial:
+            # The trial is a single status check. The other due jobs stay due
+            # and are checked on the next tick if it succeeds.
+            due = due[:1]
+        try:
+            errors = await asyncio.gather(*[self._poll(job) for job in due])
+            # All checks of a tick count as one call against the breaker, so
+            # one bad tick cannot open it on its own.
+            if any(error is None for error in errors):
+                breaker.record_success()
+            elif any(is_wbia_failure(error) for error in errors):
+                breaker.record_failure()
+        finally:
+            if trial:
+                breaker.end_trial()
+
+    async def _poll(self, job: _PendingJob):
+        """Checks the status of `job`; returns the error of a failed check."""
+        job.attempts += 1
+        try:
+            json_result = await fetch_job_status(self.client or get_client(), job.job_id)
+            status = json_result['response']['jobstatus']
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            # A failed status check is retried on the job's next turn.
+            job_status_checks.inc(outcome='error')
+            logger.warning('Status check for job %s failed: %s', job.job_id, error)
+            self._reschedule(job, asyncio.get_event_loop().time())
+            return error
+        job_status_checks.inc(outcome='ok')
+
+        job.notify(status)
+        now = asyncio.get_event_loop().time()
+        if status == JOB_STATUS_COMPLETED:
+            self._finish(job, now, 'completed', result=json_result)
+        elif status in JOB_STATUS_FAILED:
+            self._finish(job, now, 'failed', error=JobFailedError(job.job_id, status))
+        else:
+            self._reschedule(job, now)
+        return None
+
+    def _reschedule(self, job: _PendingJob, now):
+        if now >= job.deadline:
+            error = JobTimeoutError(job.job_id, job.policy.timeout, job.attempts)
+            self._finish(job, now, 'timeout', error=error)
+        else:
+            job.delay = job.policy.next_delay(job.delay)
+            job.next_poll = now + min(job.policy.jittered(job.delay), job.deadline - now)
+
+    def _finish(self, job: _PendingJob, now, outcome, result=None, error=None):
+        if self._jobs.get(job.job_id) is job:
+            del self._jobs[job.job_id]
+        jobs_finished.inc(outcome=outcome)
+        job_seconds.observe(now - job.started_at, outcome=outcome)
+        job.resolve(result, error)
+
+
+_multiplexer = None
+
+
+def get_job_multiplexer() -> JobMultiplexer:
+    global _multiplexer
+    if _multiplexer is None:
+        _multiplexer = JobMultiplexer()
+    return _multiplexer
+
+
+async def wait_for_job(job_id, policy: PollPolicy = PollPolicy(), on_status=None):
+    """Wait for a WBIA engine job through the process-wide job multiplexer."""
+    return await get_job_multiplexer().wait(job_id, policy, on_status)
@@ -0,0 +1,71 @@
+"""Leveled logging that never blocks the event loop.
+
+`configure_logging()` gives the package loggers a QueueHandler; a listener
+thread formats and writes the records to stderr. When the queue is full,
+records are dropped rather than waited on. High-volume debug logging is
+sampled with `sampled()` and large payloads are shortened with `truncate()`.
+"""
+import atexit
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+from .config import (
+    LOG_FORMAT,
+    LOG_LEVEL,
+    LOG_MAX_FIELD_LENGTH,
+    LOG_QUEUE_SIZE,
+    LOG_SAMPLE_RATE,
+)
+
+_listener = None
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(level=LOG_LEVEL):
+    global _listener
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _listener = QueueListener(log_queue, stream_handler)
+
+    logger = logging.getLogger(__package__)
+    logger.setLevel(level)
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    logger.propagate = False
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flushes the queued records and stops the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def sampled(rate=LOG_SAMPLE_RATE):
+    """Whether to log this occurrence of a high-volume debug message."""
+    return rate >= 1 or random.random() < rate
+
+
+def truncate(value, limit=LOG_MAX_FIELD_LENGTH):
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return text
+    return f'{text[:limit]}... ({len(text)} chars)'
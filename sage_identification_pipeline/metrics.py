@@ -0,0 +1,309 @@
+"""In-process metrics: counters, latency histograms and timing spans.
+
+Metrics are exported in the Prometheus text format and as JSON, both by a
+small HTTP server on SAGE_METRICS_HOST:SAGE_METRICS_PORT (/metrics and
+/metrics.json) and by `dump_json()`.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from .config import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300
+)
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f'Expected labels {labelnames}, got {sorted(labels)}')
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [
+        (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def prometheus_lines(self):
+        for key, value in self._values.items():
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+
+    def samples(self):
+        return [
+            {'labels': dict(zip(self.labelnames, key)), 'value': value}
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[_label_key(self.labelnames, labels)] = value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        counts = entry[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[-1] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the monotonic duration of the block."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def _cumulative(self, counts):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            yield bound, total
+
+    def prometheus_lines(self):
+        for key, (counts, total, count) in self._values.items():
+            for bound, cumulative in self._cumulative(counts):
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                labels = _format_labels(self.labelnames, key, [('le', le)])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {total}'
+            yield f'{self.name}_count{labels} {count}'
+
+    def samples(self):
+        return [
+            {
+                'labels': dict(zip(self.labelnames, key)),
+                'count': count,
+                'sum': total,
+                'buckets': {
+                    ('+Inf' if bound == float('inf') else f'{bound:g}'): cumulative
+                    for bound, cumulative in self._cumulative(counts)
+                },
+            }
+            for key, (counts, total, count) in self._values.items()
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, description, labelnames=()) -> Counter:
+        return self._register(Counter(name, description, labelnames))
+
+    def gauge(self, name, description, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, description, labelnames))
+
+    def histogram(
+        self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, description, labelnames, buckets))
+
+    def render_prometheus(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.prometheus_lines())
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        return {
+            name: {
+                'type': metric.type,
+                'description': metric.description,
+                'samples': metric.samples(),
+            }
+            for name, metric in self._metrics.items()
+        }
+
+
+registry = MetricsRegistry()
+
+sage_call_seconds = registry.histogram(
+    'sage_call_seconds', 'Duration of WBIA API calls.', ['function']
+)
+sage_call_errors = registry.counter(
+    'sage_call_errors_total', 'WBIA API calls that raised.', ['function']
+)
+sage_call_retries = registry.counter(
+    'sage_call_retries_total', 'WBIA API calls retried after a failure.', ['function']
+)
+circuit_breaker_opened = registry.counter(
+    'wbia_circuit_breaker_opened_total', 'Times the WBIA circuit breaker opened.'
+)
+job_status_checks = registry.counter(
+    'wbia_job_status_checks_total', 'Job status checks, by outcome.', ['outcome']
+)
+jobs_finished = registry.counter(
+    'wbia_jobs_finished_total', 'WBIA jobs that stopped being polled.', ['outcome']
+)
+job_seconds = registry.histogram(
+    'wbia_job_seconds', 'Time from the first wait until a job finished.', ['outcome']
+)
+cache_requests = registry.counter(
+    'cache_requests_total', 'Cache lookups, by cache and result.', ['cache', 'result']
+)
+asset_publications = registry.counter(
+    'asset_publications_total', 'Static assets published at startup, by result.', ['result']
+)
+thumbnail_cache_bytes = registry.gauge(
+    'evidence_thumbnail_cache_bytes', 'Size of the evidence thumbnails kept on disk.'
+)
+stage_seconds = registry.histogram(
+    'pipeline_stage_seconds', 'Duration of pipeline stages.', ['stage']
+)
+stage_queue_depth = registry.gauge(
+    'pipeline_stage_queue_depth', 'Runs waiting for a worker of a stage.', ['stage']
+)
+stage_busy_workers = registry.gauge(
+    'pipeline_stage_busy_workers', 'Stage workers processing a run.', ['stage']
+)
+stage_queue_seconds = registry.histogram(
+    'pipeline_stage_queue_seconds',
+    'Time runs waited for a stage worker, or for room in the next queue.',
+    ['stage'],
+)
+pipeline_runs = registry.counter(
+    'pipeline_runs_total', 'Pipeline runs that ended, by final status.', ['status']
+)
+ui_render_seconds = registry.histogram(
+    'ui_render_seconds', 'Duration of make_base_ui, including the page save.'
+)
+ui_cards = registry.counter(
+    'ui_cards_total', 'Cards considered by renders, by whether they were sent.',
+    ['result'],
+)
+serve_seconds = registry.histogram('serve_seconds', 'Duration of Wave serve calls.')
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorates a coroutine function to observe its duration."""
+
+    def timed_decorator(func):
+        @wraps(func)
+        async def timed_func(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+
+        return timed_func
+
+    return timed_decorator
+
+
+def dump_json(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as metrics_fp:
+        json.dump(registry.to_dict(), metrics_fp, indent=2)
+    os.replace(tmp_path, path)
+
+
+_server = None
+
+
+async def _handle_request(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        path = parts[1].split('?')[0] if len(parts) > 1 else ''
+        if path == '/metrics':
+            status, content_type = '200 OK', 'text/plain; version=0.0.4'
+            body = registry.render_prometheus().encode()
+        elif path == '/metrics.json':
+            status, content_type = '200 OK', 'application/json'
+            body = json.dumps(registry.to_dict()).encode()
+        else:
+            status, content_type, body = '404 Not Found', 'text/plain', b'Not found\n'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode()
+            + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves /metrics and /metrics.json; a port of 0 disables the server."""
+    global _server
+    if _server is not None or not port:
+        return
+    try:
+        _server = await asyncio.start_server(_handle_request, host, port)
+    except OSError as error:
+        logger.warning('Metrics server not started on %s:%s: %s', host, port, error)
+        return
+    logger.info('Serving metrics on http://%s:%s/metrics', host, port)
+
+
+async def stop_metrics_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
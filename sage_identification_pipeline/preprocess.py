@@ -0,0 +1,101 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from .config import (
+    PREPROCESS_FORMAT,
+    PREPROCESS_MAX_DIMENSION,
+    PREPROCESS_QUALITY,
+    PREPROCESS_WORKERS,
+    UPLOAD_SPOOL_DIR,
+)
+
+PREPROCESS_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+_pool = None
+
+
+class PreprocessedImage(NamedTuple):
+    path: str
+    scale: float
+    original_size: List[int]
+
+
+def pillow_available():
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def preprocess_enabled():
+    return PREPROCESS_MAX_DIMENSION > 0 and pillow_available()
+
+
+def preprocess_settings():
+    """Everything that changes the uploaded bytes, for upload cache keys."""
+    return PREPROCESS_MAX_DIMENSION, PREPROCESS_FORMAT, PREPROCESS_QUALITY
+
+
+def downscale_image(
+    path: str,
+    max_dimension: int = PREPROCESS_MAX_DIMENSION,
+    image_format: str = PREPROCESS_FORMAT,
+    quality: int = PREPROCESS_QUALITY,
+) -> Optional[PreprocessedImage]:
+    """Writes a downscaled, re-encoded copy of `path` to a temp file.
+
+    Returns None when the image already fits `max_dimension`. Runs in a
+    worker process, so it only takes and returns picklable values.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        # Boxes are drawn over the image as browsers show it, i.e. upright.
+        image = ImageOps.exif_transpose(image)
+        original_size = list(image.size)
+        scale = max_dimension / max(original_size)
+        if scale >= 1:
+            return None
+        width, height = original_size
+        resized = image.convert('RGB').resize(
+            (max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS
+        )
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    extension = PREPROCESS_EXTENSIONS.get(image_format, image_format.lower())
+    fd, out_path = tempfile.mkstemp(dir=UPLOAD_SPOOL_DIR, suffix=f'.{extension}')
+    with os.fdopen(fd, 'wb') as out_fp:
+        resized.save(out_fp, format=image_format, quality=quality)
+    return PreprocessedImage(out_path, scale, original_size)
+
+
+def scale_annotations(annotations, scale):
+    """Maps boxes detected on a downscaled image back to the original."""
+    if annotations is None or scale == 1:
+        return annotations
+    return [
+        dict(
+            annotation,
+            top=annotation['top'] / scale,
+            left=annotation['left'] / scale,
+            width=annotation['width'] / scale,
+            height=annotation['height'] / scale,
+        )
+        for annotation in annotations
+    ]
+
+
+def get_preprocess_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS)
+    return _pool
+
+
+def shutdown_preprocess_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
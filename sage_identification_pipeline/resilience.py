@@ -0,0 +1,200 @@
+"""Typed errors, retries and a circuit breaker for calls to WBIA."""
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+
+import httpx
+
+from .config import (
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_TIMEOUT,
+    RETRY_ATTEMPTS,
+    RETRY_INITIAL_DELAY,
+    RETRY_MAX_DELAY,
+)
+from .metrics import circuit_breaker_opened, sage_call_retries
+
+logger = logging.getLogger(__name__)
+
+
+class SageError(Exception):
+    """Base class of the errors raised for failed WBIA calls and jobs."""
+
+
+class SageRequestError(SageError):
+    """A WBIA request failed: transport error, timeout or error status."""
+
+    def __init__(self, function, cause, attempts=1):
+        super().__init__(f'{function} failed after {attempts} attempt(s): {cause!r}')
+        self.function = function
+        self.cause = cause
+        self.attempts = attempts
+
+
+class SageResponseError(SageError):
+    """WBIA answered, but reported a failure or returned an unexpected payload."""
+
+    def __init__(self, function, message):
+        super().__init__(f'{function}: {message}')
+        self.function = function
+
+
+class SageUnavailableError(SageError):
+    """The circuit breaker is open; WBIA is not called until it resets."""
+
+    def __init__(self, retry_in):
+        super().__init__(f'WBIA is unavailable; calls resume in {retry_in:.0f}s')
+        self.retry_in = retry_in
+
+
+# The request never reached WBIA, so even non-idempotent calls can be resent.
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+TRANSPORT_ERRORS = (httpx.TransportError,)
+RETRYABLE_STATUS_CODES = (429, 502, 503, 504)
+
+
+def is_wbia_failure(error):
+    """Whether `error` says WBIA is unhealthy, as opposed to a bad request."""
+    if isinstance(error, TRANSPORT_ERRORS):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code >= 500 or status_code == 429
+    return False
+
+
+def is_retryable(error, idempotent):
+    if isinstance(error, NOT_SENT_ERRORS):
+        return True
+    if not idempotent:
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, TRANSPORT_ERRORS)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    # Attempts per call, including the first one.
+    attempts: int = RETRY_ATTEMPTS
+    initial_delay: float = RETRY_INITIAL_DELAY
+    max_delay: float = RETRY_MAX_DELAY
+    multiplier: float = 2.0
+    jitter: float = 0.2
+
+    def next_delay(self, delay):
+        return min(delay * self.multiplier, self.max_delay)
+
+    def jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class CircuitBreaker:
+    """Fails calls fast after `failure_threshold` consecutive failed WBIA calls.
+
+    Once open, calls raise SageUnavailableError for `reset_timeout` seconds.
+    After that a single trial call is let through: its success closes the
+    breaker, its failure opens it again. A trial that ends without either,
+    e.g. a 4xx or a cancelled call, lets the next call through as a new trial.
+    """
+
+    def __init__(
+        self,
+        failure_threshold=BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=BREAKER_RESET_TIMEOUT,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def check(self):
+        """Raises SageUnavailableError unless a call may be made now.
+
+        Returns True when the call is the trial of a half-open breaker; the
+        caller must then call `end_trial` once the call is over, however it ends.
+        """
+        if self.opened_at is None:
+            return False
+        retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+        if retry_in > 0 or self._trial_running:
+            raise SageUnavailableError(max(retry_in, 0))
+        self._trial_running = True
+        return True
+
+    def end_trial(self):
+        self._trial_running = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_running or (
+            self.opened_at is None and self.failures >= self.failure_threshold
+        ):
+            if self.opened_at is None:
+                circuit_breaker_opened.inc()
+                logger.warning('WBIA circuit breaker opened after %s failures', self.failures)
+            self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+async def call_with_retries(
+    function, make_call, breaker: CircuitBreaker, policy: RetryPolicy, idempotent
+):
+    """Awaits `make_call()` under `policy` and `breaker`.
+
+    Raises SageUnavailableError when the breaker is open, SageRequestError
+    for failed requests and SageResponseError for unexpected payloads.
+    """
+    delay = policy.initial_delay
+    for attempt in range(1, policy.attempts + 1):
+        trial = breaker.check()
+        try:
+            result = await make_call()
+        except asyncio.CancelledError:
+            raise
+        except SageError:
+            breaker.record_success()
+            raise
+        except (KeyError, IndexError, TypeError, ValueError) as error:
+            # WBIA answered; only its payload was not what we expected.
+            breaker.record_success()
+            raise SageResponseError(function, f'unexpected response: {error!r}') from error
+        except Exception as error:
+            if attempt == policy.attempts or not is_retryable(error, idempotent):
+                # Only the outcome of the whole call counts against the breaker.
+                if is_wbia_failure(error):
+                    breaker.record_failure()
+                raise SageRequestError(function, error, attempt) from error
+            sage_call_retries.inc(function=function)
+            logger.info('Retrying %s after %r (attempt %s)', function, error, attempt)
+            await asyncio.sleep(policy.jittered(delay))
+            delay = policy.next_delay(delay)
+        else:
+            breaker.record_success()
+            return result
+        finally:
+            if trial:
+                breaker.end_trial()
+
+
+_breaker = None
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Returns the breaker shared by everything using the process-wide client."""
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker()
+    return _breaker
@@ -0,0 +1,236 @@
+"""Durable history of pipeline runs in an SQLite database.
+
+Every finished run is recorded with its WBIA server, parameters, upload,
+annotations, classification and identification results and stage timings. The
+database is in WAL mode and indexed by server and image digest, model tags,
+thresholds and finish time, so it can be queried for analytics while the app
+writes to it.
+
+SQLite calls block, so they run on a single thread of their own; the
+coroutines of RunStore never block the event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from .config import RUN_STORE_PATH, WBIA_API_PREFIX
+from .state import RUN_COMPLETED, PipelineParams, PipelineRun, results_complete
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    server TEXT,
+    target_image TEXT,
+    image_digest TEXT,
+    detection_model_tag TEXT NOT NULL,
+    classification_model_tag TEXT NOT NULL,
+    sensitivity REAL NOT NULL,
+    nms REAL NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    image_uuid TEXT,
+    image_size TEXT,
+    annotations TEXT,
+    classification_results TEXT,
+    identification_results TEXT,
+    stage_durations TEXT,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_image ON runs (
+    server, image_digest, detection_model_tag, classification_model_tag, sensitivity, nms, finished_at
+);
+CREATE INDEX IF NOT EXISTS runs_by_model_tags ON runs (
+    detection_model_tag, classification_model_tag, finished_at
+);
+CREATE INDEX IF NOT EXISTS runs_by_thresholds ON runs (sensitivity, nms, finished_at);
+CREATE INDEX IF NOT EXISTS runs_by_finished_at ON runs (finished_at);
+"""
+
+# Columns holding JSON documents.
+JSON_COLUMNS = (
+    'image_size',
+    'annotations',
+    'classification_results',
+    'identification_results',
+    'stage_durations',
+)
+
+
+def run_row(run: PipelineRun, server, finished_at=None) -> Dict[str, Any]:
+    row = {
+        'run_id': run.run_id,
+        'server': server,
+        'target_image': run.target_image,
+        'image_digest': run.image_digest,
+        'detection_model_tag': run.params.detection_model_tag,
+        'classification_model_tag': run.params.classification_model_tag,
+        'sensitivity': run.params.sensitivity,
+        'nms': run.params.nms,
+        'status': run.status,
+        'error': run.error,
+        'image_uuid': run.image_uuid,
+        'image_size': run.image_size,
+        'annotations': run.annotations,
+        'classification_results': run.classification_results,
+        'identification_results': run.identification_results,
+        'stage_durations': run.stage_durations,
+        'finished_at': time.time() if finished_at is None else finished_at,
+    }
+    for column in JSON_COLUMNS:
+        row[column] = json.dumps(row[column])
+    return row
+
+
+def migrate(connection: sqlite3.Connection):
+    """Adds the server column to a runs table recorded before it existed."""
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(runs)')]
+    if columns and 'server' not in columns:
+        with connection:
+            connection.execute('ALTER TABLE runs ADD COLUMN server TEXT')
+            # Recreated by SCHEMA with the server column.
+            connection.execute('DROP INDEX IF EXISTS runs_by_image')
+
+
+def row_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    record = dict(row)
+    for column in JSON_COLUMNS:
+        record[column] = json.loads(record[column]) if record[column] is not None else None
+    return record
+
+
+class RunStore:
+    """Records finished runs against WBIA `server` in the SQLite database at `path`."""
+
+    def __init__(self, path=RUN_STORE_PATH, server=WBIA_API_PREFIX):
+        self.path = path
+        self.server = server
+        self._connection = None
+        # One thread owns the connection, which also serializes all writes.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='run-store')
+
+    async def _call(self, function, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.row_factory = sqlite3.Row
+            # Readers, e.g. analytics queries, do not block the writer.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            migrate(connection)
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _insert(self, rows):
+        connection = self._connect()
+        columns = list(rows[0])
+        with connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO runs ({', '.join(columns)}) "
+                f"VALUES ({', '.join(':' + column for column in columns)})",
+                rows,
+            )
+
+    def _select(self, sql, parameters):
+        return [row_dict(row) for row in self._connect().execute(sql, parameters)]
+
+    async def record(self, runs: List[PipelineRun]):
+        """Records `runs` as they are now; a run recorded again is replaced."""
+        if runs:
+            await self._call(self._insert, [run_row(run, self.server) for run in runs])
+
+    async def find_runs(
+        self,
+        image_digest=None,
+        params: PipelineParams = None,
+        server=None,
+        status=None,
+        since=None,
+        limit=100,
+    ) -> List[Dict[str, Any]]:
+        """Returns the matching runs, most recently finished first."""
+        conditions = []
+        parameters = {'limit': limit}
+        if server is not None:
+            conditions.append('server = :server')
+            parameters['server'] = server
+        if image_digest is not None:
+            conditions.append('image_digest = :image_digest')
+            parameters['image_digest'] = image_digest
+        if params is not None:
+            conditions.append(
+                'detection_model_tag = :detection_model_tag'
+                ' AND classification_model_tag = :classification_model_tag'
+                ' AND sensitivity = :sensitivity AND nms = :nms'
+            )
+            parameters.update(
+                detection_model_tag=params.detection_model_tag,
+                classification_model_tag=params.classification_model_tag,
+                sensitivity=params.sensitivity,
+                nms=params.nms,
+            )
+        if status is not None:
+            conditions.append('status = :status')
+            parameters['status'] = status
+        if since is not None:
+            conditions.append('finished_at >= :since')
+            parameters['since'] = since
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        sql = f'SELECT * FROM runs {where} ORDER BY finished_at DESC LIMIT :limit'
+        return await self._call(self._select, sql, parameters)
+
+    async def latest_results(
+        self, image_digest, params: PipelineParams, max_age
+    ) -> Optional[Dict[str, Any]]:
+        """Results of the newest complete run younger than `max_age` seconds.
+
+        Only runs against this store's server count, since annotation and job
+        ids are not valid on others. Completed runs where the identification
+        of an annotation failed are skipped, see results_complete.
+        """
+        runs = await self.find_runs(
+            image_digest,
+            params,
+            server=self.server,
+            status=RUN_COMPLETED,
+            since=time.time() - max_age,
+            limit=10,
+        )
+        return next((run for run in runs if results_complete(run)), None)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    async def close(self):
+        await self._call(self._close)
+        self._executor.shutdown(wait=True)
+
+
+_run_store = None
+
+
+def get_run_store() -> RunStore:
+    global _run_store
+    if _run_store is None:
+        _run_store = RunStore()
+    return _run_store
+
+
+async def close_run_store():
+    global _run_store
+    if _run_store is not None:
+        await _run_store.close()
+        _run_store = None
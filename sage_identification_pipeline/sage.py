@@ -1,151 +1,531 @@
-import os 
-import time
-import httpx
-import json
-from functools import wraps
+import asyncio
+import logging
+import os
+from collections import OrderedDict
 
-from .utils import json_dump_data
+from .cache import LRUCache, cache_key
+from .config import (
+  APP_DATA_DIR,
+  CLASSIFICATION_BATCH_SIZE,
+  CLASSIFICATION_CACHE_MAX_ENTRIES,
+  DETECTION_BATCH_SIZE,
+  DETECTION_CACHE_MAX_ENTRIES,
+  IDENTIFICATION_CONCURRENCY,
+  PROGRESS_UPDATE_INTERVAL,
+  STAGE_WORKERS,
+  UPLOAD_CACHE_MAX_ENTRIES,
+  UPLOAD_CACHE_PERSIST,
+  UPLOAD_CACHE_TTL,
+  UPLOAD_HASH_FIRST_MAX_BYTES,
+  WBIA_API_PREFIX,
+)
+from .utils import file_digest
 from .common import make_base_ui
+from .state import PIPELINE_STAGES, PipelineParams, PipelineRun
+from .scheduler import StageScheduler, get_stage_scheduler
+from .resilience import SageError, SageUnavailableError
+from .sage_client import CLASSIFICATION_ALGO, SageClient, get_sage_client
+from .thumbnails import PREVIEW_VERSIONS, EvidenceThumbnails, get_evidence_thumbnails
+from .preprocess import (
+  downscale_image,
+  get_preprocess_pool,
+  preprocess_enabled,
+  preprocess_settings,
+  scale_annotations,
+)
+from .uploads import (
+  MultipartUpload,
+  WaveFile,
+  content_length,
+  iter_file_chunks,
+  spool_and_hash,
+  spool_response,
+)
 
-api_prefix = 'https://demo.dyn.wildme.io'
-
-def sage_process(verbose = False):
-  def sage_process_decorator(func):
-    @wraps(func)
-    async def handle_func(*args, **kwargs):
-      try:
-        if verbose:
-          print(f'Running Sage function {func.__name__}')
-          print(f'  Args: {args}')
-          print(f'  Kwargs: {kwargs}')
-          result = await func(*args, **kwargs)
-          print(f'  Result: {result}')
-        return result
-      except Exception as error:
-        print(f'Sage function {func.__name__} failed')
-        print(error)
-        return None
-    return handle_func
-  return sage_process_decorator
-
-@sage_process(verbose = True)
-async def post_target_image(client, image_path):
-  with open(image_path, 'rb') as imageData:
-    result = await client.post('/api/upload/image/', files = { 'image': imageData })
-    return result.json()['response']
-
-@sage_process(verbose = True)
-async def fetch_image_uuid(client, image_int):
-  result = await client.get('/api/image/uuid/', params = { 'gid_list': [image_int]})
-  json_result = result.json()
-  return json_result['response'][0]['__UUID__']
-
-@sage_process(verbose = True)
-async def fetch_image_size(client, image_int):
-  result = await client.get('/api/image/size/', params = { 'gid_list': [image_int]})
-  json_result = result.json()
-  return json_result['response'][0]
-
-@sage_process(verbose = True)
-async def kickoff_detection(client, q, uuid):
-  data = json_dump_data({'image_uuid_list': [{'__UUID__': uuid}], 'model_tag': q.args.detection_model_tag, 'sensitivity': q.args.sensitivity, 'nms_thresh': q.args.nms })
-  result = await client.post('/api/engine/detect/cnn/lightnet/', data = data)
-  return result.json()['response']
-
-@sage_process(verbose = True)
-async def get_detection_results(client, q, job_id):
-  result = await client.get('/api/engine/job/result/', params = {'jobid': job_id})
-  json_result = result.json()
-  results_list = json_result['response']['json_result']['results_list'][0]
-  annotation_list = [{'top': x['xtl'], 'left': x['ytl'], 'width': x['width'], 'height': x['height'], 'theta': x['theta'], 'uuid': x['uuid']['__UUID__'], 'id': x['id']} for x in results_list]
-  return annotation_list
-
-@sage_process(verbose = True)
-async def kickoff_classification(client, q, annotations):
-  annot_uuid_list = [{'__UUID__': x['uuid']} for x in annotations]
-  data = json_dump_data({'annot_uuid_list': annot_uuid_list, 'model_tag': q.args.classification_model_tag, 'algo': 'densenet' })
-  result = await client.post('/api/engine/labeler/cnn/', data = data)
-  json_result = result.json()
-  return json_result['response']
-
-@sage_process(verbose = True)
-async def get_classification_results(client, q, job_id):
-  result = await client.get('/api/engine/job/result/', params = {'jobid': job_id})
-  json_result = result.json()
-  return json_result['response']['json_result']
-
-@sage_process(verbose = True)
-async def kickoff_identification(client, q, annotation):
-  data = json_dump_data({'annot_uuid': {'__UUID__': annotation['uuid']}, 'database_imgsetid': 570 }) # repeat for each one 
-  result = await client.post('/api/engine/review/query/chip/best/', data = data)
-  json_result = result.json()
-  return json_result['response']
-
-@sage_process(verbose = True)
-async def get_identification_results(client, q, job_id):
-  result = await client.get('/api/engine/job/result/', params = {'jobid': job_id})
-  json_result = result.json()
-  return json_result['response']['json_result']['extern']
-
-async def poll_status(client, job_id, max_attempts = 12):
-  print(f'Running poll status function with job id {job_id}')
-  attempt_count = 1
-  while attempt_count < max_attempts + 1:
-    result = await client.get('/api/engine/job/status/', params = { 'jobid': job_id })
-    json_result = result.json()
-    status = json_result['response']['jobstatus']
-    if (status == 'completed'):
-      print(f'  Attempt {attempt_count}: complete')
-      print(f'  Result: {json_result}')
-      return json_result
-    print(f'  Attempt {attempt_count}: not complete')
-    attempt_count += 1
-    time.sleep(3) # wait 3 seconds before polling again 
-  print('  Maximum number of attempts exceeded. Returning None.')
-  return  None
-
-async def run_pipeline(q, local_image_path):
-  print('...starting pipeline')
-  async with httpx.AsyncClient(base_url=api_prefix) as client:
-
-    image_int = await post_target_image(client, local_image_path)
-    image_uuid = await fetch_image_uuid(client, image_int)
-    image_size = await fetch_image_size(client, image_int)
-
-    q.app.image_size = image_size
-    q.app.upload_complete = True
-    q.app.detection_in_progress = True
-    await make_base_ui(q)
-
-    detection_job_id = await kickoff_detection(client, q, image_uuid)
-    detection_completed = await poll_status(client, detection_job_id)
-    annotations = await get_detection_results(client, q, detection_job_id)
-
-    q.app.detection_complete = True
-    q.app.detection_in_progress = False
-    q.app.classification_in_progress = True
-    q.app.annotations = annotations
-    await make_base_ui(q)
-
-    classification_job_id = await kickoff_classification(client, q, annotations)
-    classification_completed = await poll_status(client, classification_job_id)
-    classification_results = await get_classification_results(client, q, classification_job_id)
-
-    q.app.classification_results = classification_results
-    q.app.classification_complete = True
-    q.app.classification_in_progress = False
-    q.app.identification_in_progress = True
-    await make_base_ui(q)
-
-    identification_results = []
-    for annotation in annotations[:3]:
-      identification_job_id = await kickoff_identification(client, q, annotation)
-      identification_completed = await poll_status(client, identification_job_id, 120)
-      job_results = await get_identification_results(client, q, identification_job_id)
-      identification_results.append(job_results)
-
-    q.app.identification_results = identification_results
-    q.app.identification_complete = True
-    q.app.identification_in_progress = False
-    await make_base_ui(q)
+logger = logging.getLogger(__name__)
 
+# (WBIA server, image digest[, preprocessing settings]), see upload_key ->
+# {'gid', 'uuid', 'size'[, 'scale']} of images already known to that server.
+upload_cache = LRUCache(
+  name = 'uploads',
+  max_entries = UPLOAD_CACHE_MAX_ENTRIES,
+  ttl = UPLOAD_CACHE_TTL,
+  path = os.path.join(APP_DATA_DIR, 'cache', 'uploads.json') if UPLOAD_CACHE_PERSIST else None,
+)
+# (image uuid, model tag, sensitivity, nms) -> annotation list.
+detection_cache = LRUCache(name = 'detections', max_entries = DETECTION_CACHE_MAX_ENTRIES)
+# (algo, model tag, annotation uuid) -> classification.
+classification_cache = LRUCache(name = 'classifications', max_entries = CLASSIFICATION_CACHE_MAX_ENTRIES)
+
+def upload_key(digest):
+  # Gids are only valid on the server that assigned them, e.g. not on a test server.
+  if not preprocess_enabled():
+    return cache_key(WBIA_API_PREFIX, digest)
+  return cache_key(WBIA_API_PREFIX, digest, *preprocess_settings())
+
+def url_key(url):
+  # Digests are only known for Wave files uploaded to this server.
+  return cache_key('url', WBIA_API_PREFIX, url)
+
+def remember_upload(digest, upload, url=None):
+  upload_cache.set(upload_key(digest), upload)
+  if url is not None:
+    # Wave file URLs alias the digest, so repeat runs skip the download too.
+    upload_cache.set(url_key(url), digest)
+
+async def upload_local_image(sage: SageClient, local_image_path, url=None):
+  loop = asyncio.get_event_loop()
+  digest = await loop.run_in_executor(None, file_digest, local_image_path)
+  upload = upload_cache.get(upload_key(digest))
+  if upload is not None:
+    logger.debug('Image %s already uploaded as gid %s', digest, upload['gid'])
+    if url is not None:
+      upload_cache.set(url_key(url), digest)
+    return dict(upload, digest = digest)
+
+  if preprocess_enabled():
+    upload = await upload_preprocessed_image(sage, local_image_path)
+  else:
+    upload = await sage.upload(local_image_path)
+  remember_upload(digest, upload, url)
+  return dict(upload, digest = digest)
+
+async def upload_preprocessed_image(sage: SageClient, local_image_path):
+  loop = asyncio.get_event_loop()
+  preprocessed = await loop.run_in_executor(get_preprocess_pool(), downscale_image, local_image_path)
+  if preprocessed is None:
+    return await sage.upload(local_image_path)
+
+  try:
+    upload = await sage.upload(preprocessed.path)
+  finally:
+    os.remove(preprocessed.path)
+  # WBIA only knows the downscaled image; report the original's size.
+  upload['size'] = preprocessed.original_size
+  upload['scale'] = preprocessed.scale
+  return upload
+
+def known_image_digest(url):
+  """Digest of the image at a Wave `url` that was uploaded before, if any."""
+  return upload_cache.get(url_key(url))
+
+async def upload_wave_image(sage: SageClient, image: WaveFile):
+  digest = known_image_digest(image.url)
+  upload = upload_cache.get(upload_key(digest)) if digest is not None else None
+  if upload is not None:
+    logger.debug('Image %s already uploaded as gid %s', image.url, upload['gid'])
+    return dict(upload, digest = digest)
+
+  spool = None
+  async with image.stream() as response:
+    response.raise_for_status()
+    size = content_length(response)
+    # Downscaling needs the whole image on disk.
+    if size is None or preprocess_enabled():
+      spool_path = await spool_response(response, image.filename)
+    elif size <= UPLOAD_HASH_FIRST_MAX_BYTES:
+      # Small enough to hash before uploading, see upload_spooled_image.
+      spool, digest = await spool_and_hash(response)
+    else:
+      # Pipe the image from the Wave file store straight into the upload.
+      body = MultipartUpload(image.filename, response.aiter_raw(), size)
+      upload = await sage.upload(body)
+      remember_upload(body.hexdigest(), upload, image.url)
+      return dict(upload, digest = body.hexdigest())
+
+  if spool is not None:
+    with spool:
+      return await upload_spooled_image(sage, image, spool, digest, size)
+  try:
+    return await upload_local_image(sage, spool_path, image.url)
+  finally:
+    os.remove(spool_path)
+
+async def upload_spooled_image(sage: SageClient, image: WaveFile, spool, digest, size):
+  upload = upload_cache.get(upload_key(digest))
+  if upload is not None:
+    # The same image, uploaded before under another URL.
+    logger.debug('Image %s already uploaded as gid %s', image.url, upload['gid'])
+    upload_cache.set(url_key(image.url), digest)
+    return dict(upload, digest = digest)
+
+  upload = await sage.upload(MultipartUpload(image.filename, iter_file_chunks(spool), size))
+  remember_upload(digest, upload, image.url)
+  return dict(upload, digest = digest)
+
+async def upload_image(sage: SageClient, image):
+  """Uploads a local image path or a WaveFile, unless WBIA already has it.
+
+  Returns the upload's gid, uuid and size, plus the digest of the image.
+  """
+  if isinstance(image, WaveFile):
+    return await upload_wave_image(sage, image)
+  return await upload_local_image(sage, image)
+
+def chunked(items, size):
+  return [items[start:start + size] for start in range(0, len(items), size)]
+
+async def detect_annotations_many(sage: SageClient, image_uuids, params: PipelineParams, on_status=None):
+  """Returns the annotations of every image; uncached images share one job."""
+  keys = [cache_key(uuid, params.detection_model_tag, params.sensitivity, params.nms) for uuid in image_uuids]
+  results = [detection_cache.get(key) for key in keys]
+  missing = [index for index, annotations in enumerate(results) if annotations is None]
+  if missing:
+    detected = await sage.detect_many([image_uuids[index] for index in missing], params, on_status)
+    for index, annotations in zip(missing, detected):
+      detection_cache.set(keys[index], annotations)
+      results[index] = annotations
+  return results
+
+async def detect_annotations(sage: SageClient, image_uuid, params: PipelineParams, on_status=None):
+  return (await detect_annotations_many(sage, [image_uuid], params, on_status))[0]
+
+async def classify_annotations(sage: SageClient, annotations, params: PipelineParams, on_status=None):
+  """Classifies uncached annotations in jobs of CLASSIFICATION_BATCH_SIZE."""
+  keys = {a['uuid']: cache_key(CLASSIFICATION_ALGO, params.classification_model_tag, a['uuid']) for a in annotations}
+  classifications = {uuid: classification_cache.get(key) for uuid, key in keys.items()}
+  missing = [a for a in annotations if classifications[a['uuid']] is None]
+  batches = chunked(missing, CLASSIFICATION_BATCH_SIZE)
+  batch_results = await asyncio.gather(*[sage.classify(batch, params, on_status) for batch in batches])
+  for batch, results in zip(batches, batch_results):
+    for annotation, result in zip(batch, results):
+      classification_cache.set(keys[annotation['uuid']], result)
+      classifications[annotation['uuid']] = result
+  return [classifications[a['uuid']] for a in annotations]
+
+async def identify_annotation(sage: SageClient, semaphore, index, annotation, on_status=None):
+  async with semaphore:
+    try:
+      job_results = await sage.identify(annotation, on_status)
+    except SageUnavailableError:
+      # WBIA is down; fail the run rather than every remaining annotation.
+      raise
+    except SageError as error:
+      logger.warning('Identification of annotation %s failed: %s', annotation['uuid'], error)
+      return index, None
+    return index, job_results
+
+class ThrottledUpdate:
+  """Coalesces progress events into at most one `update` per `interval`."""
+
+  def __init__(self, update, interval = PROGRESS_UPDATE_INTERVAL):
+    self.update = update
+    self.interval = interval
+    self.last_update = 0.0
+    self._task = None
+
+  def request(self):
+    if self._task is None or self._task.done():
+      self._task = asyncio.ensure_future(self._run())
+
+  def updated(self):
+    self.last_update = asyncio.get_event_loop().time()
+
+  def cancel(self):
+    if self._task is not None:
+      self._task.cancel()
+
+  async def _run(self):
+    loop = asyncio.get_event_loop()
+    delay = self.last_update + self.interval - loop.time()
+    if delay > 0:
+      await asyncio.sleep(delay)
+    self.updated()
+    try:
+      await self.update()
+    except Exception as error:
+      logger.warning('Progress update failed: %r', error)
+
+class PipelineExecution:
+  """The stages of one pipeline run, run one at a time by execute_pipeline.
+
+  Results are written onto `run`; `on_update` is awaited after every stage
+  transition, which is how the Wave UI follows along. Job status events only
+  update `run.stages` and are rendered at a throttled rate. With `evidence`,
+  the preview thumbnails of identification results are prefetched.
+  """
+
+  def __init__(self, sage: SageClient, run: PipelineRun, image, on_update=None, evidence: EvidenceThumbnails = None):
+    self.sage = sage
+    self.run = run
+    self.image = image
+    self.on_update = on_update
+    self.progress_update = ThrottledUpdate(on_update or self.no_update)
+    self.upload = None
+    # Bounds the identification jobs in flight; may be shared between runs.
+    self.identification_semaphore = asyncio.Semaphore(IDENTIFICATION_CONCURRENCY)
+    self.evidence = evidence
+
+  async def no_update(self):
+    pass
+
+  async def update(self):
+    self.progress_update.updated()
+    if self.on_update is not None:
+      await self.on_update()
+
+  def job_status_listener(self, stage):
+    def on_status(job_id, status, attempts):
+      self.run.stages[stage].job_status(job_id, status, attempts)
+      self.progress_update.request()
+    return on_status
+
+  def stage_queued(self, stage):
+    run = self.run
+    run.queued_stage = stage
+    if stage == 'detection':
+      run.detection_in_progress = True
+    elif stage == 'classification':
+      run.classification_in_progress = True
+    elif stage == 'identification':
+      run.identification_in_progress = True
+    self.progress_update.request()
+
+  async def run_stage(self, stage):
+    stages = {
+      'upload': self.upload_stage,
+      'detection': self.detection_stage,
+      'classification': self.classification_stage,
+      'identification': self.identification_stage,
+    }
+    await stages[stage]()
+
+  def close(self):
+    self.progress_update.cancel()
+
+  async def upload_stage(self):
+    run = self.run
+    run.start_stage('upload')
+    self.upload = await upload_image(self.sage, self.image)
+
+    run.image_digest = self.upload['digest']
+    run.image_uuid = self.upload['uuid']
+    run.image_size = self.upload['size']
+    run.upload_complete = True
+    run.finish_stage('upload')
+    await self.update()
+
+  async def begin_stage(self, stage):
+    self.run.start_stage(stage)
+    await self.update()
+
+  async def detection_stage(self):
+    await self.begin_stage('detection')
+    annotations = await detect_annotations(
+      self.sage, self.run.image_uuid, self.run.params, self.job_status_listener('detection')
+    )
+    await self.finish_detection(annotations)
+
+  async def finish_detection(self, annotations):
+    run = self.run
+    run.annotations = scale_annotations(annotations, self.upload.get('scale', 1))
+    run.detection_complete = True
+    run.detection_in_progress = False
+    run.finish_stage('detection')
+    await self.update()
+
+  async def classification_stage(self):
+    await self.begin_stage('classification')
+    classification_results = await classify_annotations(
+      self.sage, self.run.annotations, self.run.params, self.job_status_listener('classification')
+    )
+    await self.finish_classification(classification_results)
+
+  async def finish_classification(self, classification_results):
+    run = self.run
+    run.classification_results = classification_results
+    run.classification_complete = True
+    run.classification_in_progress = False
+    run.finish_stage('classification')
+    await self.update()
+
+  async def identification_stage(self):
+    run = self.run
+    annotations = run.annotations
+    identification_results = [None] * len(annotations)
+    run.identification_results = identification_results
+    run.identification_done = 0
+    identification = run.start_stage('identification', total=len(annotations))
+    await self.update()
+
+    on_status = self.job_status_listener('identification')
+    semaphore = self.identification_semaphore
+    tasks = [
+      asyncio.ensure_future(identify_annotation(self.sage, semaphore, index, annotation, on_status))
+      for index, annotation in enumerate(annotations)
+    ]
+    prefetches = []
+    try:
+      for next_completed in asyncio.as_completed(tasks):
+        index, job_results = await next_completed
+        identification_results[index] = job_results
+        if self.evidence is not None and job_results:
+          prefetch = self.evidence.prefetch(self.sage, job_results, PREVIEW_VERSIONS)
+          prefetches.append(asyncio.ensure_future(prefetch))
+        run.identification_done += 1
+        identification.done = run.identification_done
+        await self.update()
+      # The final render then shows the cached thumbnails.
+      await asyncio.gather(*prefetches)
+    finally:
+      for task in tasks + prefetches:
+        task.cancel()
+
+    run.identification_complete = True
+    run.identification_in_progress = False
+    run.finish_stage('identification')
+    await self.update()
+
+async def execute_pipeline(
+  sage: SageClient,
+  run: PipelineRun,
+  image,
+  on_update=None,
+  scheduler: StageScheduler = None,
+  evidence: EvidenceThumbnails = None,
+):
+  """Run upload, detection, classification and identification for `run`.
+
+  `image` is a local image path or a WaveFile. With a `scheduler`, the stages
+  run on its per-stage workers, overlapping with the stages of other runs;
+  otherwise they run one after the other in the calling task. See
+  PipelineExecution for `on_update` and `evidence`. Needs no Wave context.
+  """
+  execution = PipelineExecution(sage, run, image, on_update, evidence)
+  try:
+    if scheduler is not None:
+      await scheduler.run(execution)
+    else:
+      for stage in PIPELINE_STAGES:
+        execution.stage_queued(stage)
+        await execution.run_stage(stage)
+  finally:
+    execution.close()
+
+def batch_status_listener(executions, stage):
+  """Reports the status of a job shared by `executions` to each of them."""
+  listeners = [execution.job_status_listener(stage) for execution in executions]
+  def on_status(job_id, status, attempts):
+    for listener in listeners:
+      listener(job_id, status, attempts)
+  return on_status
+
+async def detect_batch(sage: SageClient, executions, params: PipelineParams):
+  for execution in executions:
+    execution.stage_queued('detection')
+    await execution.begin_stage('detection')
+  annotation_lists = await detect_annotations_many(
+    sage,
+    [execution.run.image_uuid for execution in executions],
+    params,
+    batch_status_listener(executions, 'detection'),
+  )
+  for execution, annotations in zip(executions, annotation_lists):
+    await execution.finish_detection(annotations)
+
+async def classify_batch(sage: SageClient, executions, params: PipelineParams):
+  for execution in executions:
+    execution.stage_queued('classification')
+    await execution.begin_stage('classification')
+  annotations = [a for execution in executions for a in execution.run.annotations]
+  classification_results = await classify_annotations(
+    sage, annotations, params, batch_status_listener(executions, 'classification')
+  )
+  start = 0
+  for execution in executions:
+    end = start + len(execution.run.annotations)
+    await execution.finish_classification(classification_results[start:end])
+    start = end
+
+async def execute_pipelines(sage: SageClient, runs, images, on_update=None, evidence: EvidenceThumbnails = None):
+  """Run the pipeline for several images, sharing WBIA jobs between them.
+
+  Runs are processed in batches of DETECTION_BATCH_SIZE images with the same
+  params. The images of a batch are uploaded concurrently, then detected in
+  one WBIA job and classified in as few jobs as CLASSIFICATION_BATCH_SIZE
+  allows. Identification stays one job per annotation, with as many jobs in
+  flight as STAGE_WORKERS['identification'] separate runs would have.
+  Batches overlap.
+
+  Returns one exception or None per run: a failed upload only fails its run,
+  a failed detection or classification job fails every run of its batch.
+  """
+  executions = [PipelineExecution(sage, run, image, on_update, evidence) for run, image in zip(runs, images)]
+  errors = {}
+  upload_semaphore = asyncio.Semaphore(STAGE_WORKERS['upload'])
+  identification_semaphore = asyncio.Semaphore(IDENTIFICATION_CONCURRENCY * STAGE_WORKERS['identification'])
+  for execution in executions:
+    execution.identification_semaphore = identification_semaphore
+
+  async def guarded(batch, coro):
+    try:
+      await coro
+    except asyncio.CancelledError:
+      raise
+    except Exception as error:
+      logger.warning('Pipeline runs %s failed: %r', [e.run.run_id for e in batch], error)
+      for execution in batch:
+        errors[execution] = error
+
+  async def upload(execution):
+    async with upload_semaphore:
+      await execution.run_stage('upload')
+
+  async def run_batch(batch, params):
+    for execution in batch:
+      execution.stage_queued('upload')
+    await asyncio.gather(*[guarded([e], upload(e)) for e in batch])
+    batch = [e for e in batch if e not in errors]
+    if batch:
+      await guarded(batch, detect_batch(sage, batch, params))
+    batch = [e for e in batch if e not in errors]
+    if batch:
+      await guarded(batch, classify_batch(sage, batch, params))
+    batch = [e for e in batch if e not in errors]
+    for execution in batch:
+      execution.stage_queued('identification')
+    await asyncio.gather(*[guarded([e], e.run_stage('identification')) for e in batch])
+
+  by_params = OrderedDict()
+  for execution in executions:
+    by_params.setdefault(execution.run.params, []).append(execution)
+  try:
+    await asyncio.gather(*[
+      run_batch(batch, params)
+      for params, group in by_params.items()
+      for batch in chunked(group, DETECTION_BATCH_SIZE)
+    ])
+  finally:
+    for execution in executions:
+      execution.close()
+  return [errors.get(execution) for execution in executions]
+
+async def run_pipeline(q, run: PipelineRun):
+  logger.info('Starting pipeline run %s', run.run_id)
+  await execute_pipeline(
+    get_sage_client(),
+    run,
+    WaveFile(run.target_image),
+    on_update = lambda: make_base_ui(q),
+    scheduler = get_stage_scheduler(),
+    evidence = get_evidence_thumbnails(),
+  )
+
+async def run_pipelines(q, runs):
+  logger.info('Starting %s pipeline runs', len(runs))
+  # Many runs report progress at once; render at most once per interval.
+  session_update = ThrottledUpdate(lambda: make_base_ui(q))
+
+  async def on_update():
+    session_update.request()
+
+  try:
+    return await execute_pipelines(
+      get_sage_client(),
+      runs,
+      [WaveFile(run.target_image) for run in runs],
+      on_update = on_update,
+      evidence = get_evidence_thumbnails(),
+    )
+  finally:
+    session_update.cancel()
@@ -0,0 +1,374 @@
+import asyncio
+import logging
+from functools import wraps
+from typing import Any, Dict, List, Optional, Union
+
+import httpx
+
+from .config import (
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_JOB_START_TIMEOUT,
+    HTTP_QUERY_TIMEOUT,
+    HTTP_UPLOAD_TIMEOUT,
+    WBIA_API_PREFIX,
+)
+from .connections import create_client, get_client
+from .jobs import (
+    CLASSIFICATION_POLL_POLICY,
+    DETECTION_POLL_POLICY,
+    IDENTIFICATION_POLL_POLICY,
+    JOB_STATUS_QUEUED,
+    JobMultiplexer,
+    PollPolicy,
+    get_job_multiplexer,
+)
+from .logs import sampled, truncate
+from .metrics import sage_call_errors, sage_call_seconds
+from .resilience import (
+    CircuitBreaker,
+    RetryPolicy,
+    SageError,
+    call_with_retries,
+    get_circuit_breaker,
+)
+from .state import PipelineParams
+from .uploads import MultipartUpload
+from .utils import json_dump_data
+
+CLASSIFICATION_ALGO = 'densenet'
+IDENTIFICATION_DATABASE_IMGSETID = 570
+
+Annotation = Dict[str, Any]
+
+UPLOAD_TIMEOUT = httpx.Timeout(HTTP_UPLOAD_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+JOB_START_TIMEOUT = httpx.Timeout(HTTP_JOB_START_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+QUERY_TIMEOUT = httpx.Timeout(HTTP_QUERY_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+
+def wbia_response(result: httpx.Response):
+    """Returns the `response` field of a WBIA reply, raising on any failure."""
+    result.raise_for_status()
+    json_result = result.json()
+    status = json_result.get('status') or {}
+    if status.get('success') is False:
+        raise ValueError(f"WBIA reported failure: {status.get('message')!r}")
+    return json_result['response']
+
+
+def wbia_job_id(result: httpx.Response) -> str:
+    job_id = wbia_response(result)
+    if not job_id:
+        raise ValueError('WBIA returned no job id')
+    return job_id
+
+
+def sage_process(verbose=False, idempotent=False):
+    """Runs a SageClient call under the client's retry policy and breaker.
+
+    Failures raise SageError subclasses (see resilience.py). Only `idempotent`
+    calls are retried after WBIA may have received them. With `verbose`, a
+    sample of the calls and their results is logged at debug level, with the
+    payloads truncated.
+    """
+
+    def sage_process_decorator(func):
+        @wraps(func)
+        async def handle_func(self, *args, **kwargs):
+            log_call = verbose and logger.isEnabledFor(logging.DEBUG) and sampled()
+            try:
+                if log_call:
+                    logger.debug(
+                        'Sage call %s args=%s kwargs=%s',
+                        func.__name__,
+                        truncate(args),
+                        truncate(kwargs),
+                    )
+                with sage_call_seconds.time(function=func.__name__):
+                    result = await call_with_retries(
+                        func.__name__,
+                        lambda: func(self, *args, **kwargs),
+                        self.breaker,
+                        self.retry_policy,
+                        idempotent,
+                    )
+                if log_call:
+                    logger.debug('Sage call %s result=%s', func.__name__, truncate(result))
+                return result
+            except SageError as error:
+                sage_call_errors.inc(function=func.__name__)
+                logger.warning('Sage call %s failed: %s', func.__name__, error)
+                raise
+
+        return handle_func
+
+    return sage_process_decorator
+
+
+class SageClient:
+    """Async client for the WBIA endpoints used by the pipeline.
+
+    By default it shares the process-wide HTTP client, job multiplexer and
+    circuit breaker. Passing `base_url` gives it a private HTTP client,
+    multiplexer and breaker instead, which `aclose()` releases.
+    """
+
+    def __init__(
+        self,
+        http_client: Optional[httpx.AsyncClient] = None,
+        base_url: Optional[str] = None,
+        multiplexer: Optional[JobMultiplexer] = None,
+        retry_policy: RetryPolicy = RetryPolicy(),
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self._owns_http_client = http_client is None and base_url is not None
+        if self._owns_http_client:
+            http_client = create_client(base_url=base_url)
+        self._http_client = http_client
+        if breaker is None and http_client is not None:
+            breaker = CircuitBreaker()
+        self._breaker = breaker
+        if multiplexer is None and http_client is not None:
+            multiplexer = JobMultiplexer(client=http_client, breaker=breaker)
+        self._multiplexer = multiplexer
+        self.retry_policy = retry_policy
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        return self._http_client or get_client()
+
+    @property
+    def multiplexer(self) -> JobMultiplexer:
+        return self._multiplexer or get_job_multiplexer()
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker or get_circuit_breaker()
+
+    async def aclose(self):
+        if self._multiplexer is not None:
+            await self._multiplexer.close()
+        if self._owns_http_client:
+            await self._http_client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    @sage_process(verbose=True)
+    async def post_image(self, image: Union[str, MultipartUpload]) -> int:
+        if isinstance(image, str):
+            image = MultipartUpload.from_file(image)
+        result = await self.http.post(
+            '/api/upload/image/',
+            content=image,
+            headers=image.headers,
+            timeout=UPLOAD_TIMEOUT,
+        )
+        return wbia_response(result)
+
+    @sage_process(verbose=True, idempotent=True)
+    async def fetch_image_uuid(self, image_int: int) -> str:
+        result = await self.http.get(
+            '/api/image/uuid/', params={'gid_list': [image_int]}, timeout=QUERY_TIMEOUT
+        )
+        return wbia_response(result)[0]['__UUID__']
+
+    @sage_process(verbose=True, idempotent=True)
+    async def fetch_image_size(self, image_int: int) -> List[int]:
+        result = await self.http.get(
+            '/api/image/size/', params={'gid_list': [image_int]}, timeout=QUERY_TIMEOUT
+        )
+        return wbia_response(result)[0]
+
+    async def upload(self, image: Union[str, MultipartUpload]) -> Dict[str, Any]:
+        image_int = await self.post_image(image)
+        image_uuid = await self.fetch_image_uuid(image_int)
+        image_size = await self.fetch_image_size(image_int)
+        return {'gid': image_int, 'uuid': image_uuid, 'size': image_size}
+
+    async def wait_for_job(
+        self, job_id: str, policy: PollPolicy = PollPolicy(), on_status=None
+    ):
+        """Waits for a job; `on_status` also gets a 'queued' event up front."""
+        if on_status is not None:
+            on_status(job_id, JOB_STATUS_QUEUED, 0)
+        return await self.multiplexer.wait(job_id, policy, on_status)
+
+    @sage_process(verbose=True)
+    async def start_detection(self, image_uuids: List[str], params: PipelineParams) -> str:
+        data = json_dump_data(
+            {
+                'image_uuid_list': [{'__UUID__': image_uuid} for image_uuid in image_uuids],
+                'model_tag': params.detection_model_tag,
+                'sensitivity': params.sensitivity,
+                'nms_thresh': params.nms,
+            }
+        )
+        result = await self.http.post(
+            '/api/engine/detect/cnn/lightnet/', data=data, timeout=JOB_START_TIMEOUT
+        )
+        return wbia_job_id(result)
+
+    async def job_result(self, job_id: str):
+        result = await self.http.get(
+            '/api/engine/job/result/', params={'jobid': job_id}, timeout=QUERY_TIMEOUT
+        )
+        return wbia_response(result)['json_result']
+
+    @sage_process(verbose=True, idempotent=True)
+    async def detection_results(self, job_id: str) -> List[List[Annotation]]:
+        """Returns the annotations of every image of the job, in job order."""
+        results_list = (await self.job_result(job_id))['results_list']
+        return [
+            [
+                {
+                    'top': x['xtl'],
+                    'left': x['ytl'],
+                    'width': x['width'],
+                    'height': x['height'],
+                    'theta': x['theta'],
+                    'uuid': x['uuid']['__UUID__'],
+                    'id': x['id'],
+                }
+                for x in image_results
+            ]
+            for image_results in results_list
+        ]
+
+    async def detect_many(
+        self, image_uuids: List[str], params: PipelineParams, on_status=None
+    ) -> List[List[Annotation]]:
+        """Detects the annotations of several images in a single WBIA job."""
+        job_id = await self.start_detection(image_uuids, params)
+        await self.wait_for_job(job_id, DETECTION_POLL_POLICY, on_status)
+        return await self.detection_results(job_id)
+
+    async def detect(
+        self, image_uuid: str, params: PipelineParams, on_status=None
+    ) -> List[Annotation]:
+        return (await self.detect_many([image_uuid], params, on_status))[0]
+
+    @sage_process(verbose=True)
+    async def start_classification(
+        self, annotations: List[Annotation], params: PipelineParams
+    ) -> str:
+        annot_uuid_list = [{'__UUID__': x['uuid']} for x in annotations]
+        data = json_dump_data(
+            {
+                'annot_uuid_list': annot_uuid_list,
+                'model_tag': params.classification_model_tag,
+                'algo': CLASSIFICATION_ALGO,
+            }
+        )
+        result = await self.http.post(
+            '/api/engine/labeler/cnn/', data=data, timeout=JOB_START_TIMEOUT
+        )
+        return wbia_job_id(result)
+
+    @sage_process(verbose=True, idempotent=True)
+    async def classification_results(self, job_id: str) -> List[Dict[str, Any]]:
+        return await self.job_result(job_id)
+
+    async def classify(
+        self, annotations: List[Annotation], params: PipelineParams, on_status=None
+    ) -> List[Dict[str, Any]]:
+        job_id = await self.start_classification(annotations, params)
+        await self.wait_for_job(job_id, CLASSIFICATION_POLL_POLICY, on_status)
+        return await self.classification_results(job_id)
+
+    @sage_process(verbose=True)
+    async def start_identification(self, annotation: Annotation) -> str:
+        data = json_dump_data(
+            {
+                'annot_uuid': {'__UUID__': annotation['uuid']},
+                'database_imgsetid': IDENTIFICATION_DATABASE_IMGSETID,
+            }
+        )
+        result = await self.http.post(
+            '/api/engine/review/query/chip/best/', data=data, timeout=JOB_START_TIMEOUT
+        )
+        return wbia_job_id(result)
+
+    @sage_process(verbose=True, idempotent=True)
+    async def identification_results(self, job_id: str) -> Dict[str, Any]:
+        return (await self.job_result(job_id))['extern']
+
+    async def identify(self, annotation: Annotation, on_status=None) -> Dict[str, Any]:
+        job_id = await self.start_identification(annotation)
+        await self.wait_for_job(job_id, IDENTIFICATION_POLL_POLICY, on_status)
+        return await self.identification_results(job_id)
+
+    @sage_process(idempotent=True)
+    async def fetch_match_thumbnail(
+        self, extern_reference: str, query_annot_uuid: str, database_annot_uuid: str, version: str
+    ) -> bytes:
+        result = await self.http.get(
+            '/api/query/graph/match/thumb/',
+            params={
+                'extern_reference': extern_reference,
+                'query_annot_uuid': query_annot_uuid,
+                'database_annot_uuid': database_annot_uuid,
+                'version': version,
+            },
+            timeout=QUERY_TIMEOUT,
+        )
+        result.raise_for_status()
+        return result.content
+
+
+class SyncSageClient:
+    """Blocking facade over SageClient, for scripts and microbenchmarks.
+
+    Owns a private event loop, HTTP client and job multiplexer; do not use it
+    from inside a running event loop.
+    """
+
+    def __init__(self, base_url: Optional[str] = None):
+        self._loop = asyncio.new_event_loop()
+        self._client = self._run(self._create(base_url or WBIA_API_PREFIX))
+
+    async def _create(self, base_url):
+        return SageClient(base_url=base_url)
+
+    def _run(self, coro):
+        return self._loop.run_until_complete(coro)
+
+    def close(self):
+        self._run(self._client.aclose())
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def upload(self, image_path: str) -> Dict[str, Any]:
+        return self._run(self._client.upload(image_path))
+
+    def detect(self, image_uuid: str, params: PipelineParams = PipelineParams()):
+        return self._run(self._client.detect(image_uuid, params))
+
+    def classify(self, annotations: List[Annotation], params: PipelineParams = PipelineParams()):
+        return self._run(self._client.classify(annotations, params))
+
+    def identify(self, annotation: Annotation) -> Dict[str, Any]:
+        return self._run(self._client.identify(annotation))
+
+    def wait_for_job(self, job_id: str, policy: PollPolicy = PollPolicy()):
+        return self._run(self._client.wait_for_job(job_id, policy))
+
+
+_sage_client = None
+
+
+def get_sage_client() -> SageClient:
+    """Returns the SageClient on the shared HTTP client and job multiplexer."""
+    global _sage_client
+    if _sage_client is None:
+        _sage_client = SageClient()
+    return _sage_client
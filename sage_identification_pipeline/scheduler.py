@@ -0,0 +1,135 @@
+"""Runs pipelines stage by stage, overlapping the stages of different runs.
+
+Every stage has its own pool of workers fed by a bounded queue, so one run
+uploads while another is detecting. A worker that finished its stage waits
+for room in the next stage's queue before it takes another run: a slow stage
+holds back the stages before it, down to `StageScheduler.run()`, which waits
+once the first queue is full.
+"""
+import asyncio
+import logging
+import time
+
+from .config import STAGE_QUEUE_SIZE, STAGE_WORKERS
+from .metrics import stage_busy_workers, stage_queue_depth, stage_queue_seconds
+from .state import PIPELINE_STAGES
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ('item', 'future', 'task', 'queued_at')
+
+    def __init__(self, item, future):
+        self.item = item
+        self.future = future
+        self.task = None
+        self.queued_at = None
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        # The caller of run() was cancelled: stop the stage in progress.
+        if future.cancelled() and self.task is not None:
+            self.task.cancel()
+
+
+class StageScheduler:
+    """Passes items through `stages`, each with its own workers and queue.
+
+    Items provide `async run_stage(stage)` and `stage_queued(stage)`, which is
+    called when the item starts waiting for a worker of `stage`.
+    """
+
+    def __init__(self, stages=PIPELINE_STAGES, workers=None, queue_size=STAGE_QUEUE_SIZE):
+        workers = STAGE_WORKERS if workers is None else workers
+        self.stages = tuple(stages)
+        self.workers = {stage: max(1, workers.get(stage, 1)) for stage in self.stages}
+        self.queue_size = queue_size
+        self._queues = None
+        self._tasks = []
+
+    def depths(self):
+        """Returns {stage: items waiting for a worker of the stage}."""
+        if self._queues is None:
+            return {stage: 0 for stage in self.stages}
+        return {stage: queue.qsize() for stage, queue in self._queues.items()}
+
+    def _ensure_running(self):
+        if self._tasks:
+            return
+        self._queues = {stage: asyncio.Queue(self.queue_size) for stage in self.stages}
+        for index, stage in enumerate(self.stages):
+            for _worker in range(self.workers[stage]):
+                self._tasks.append(asyncio.ensure_future(self._work(index)))
+
+    async def run(self, item):
+        """Runs all stages of `item`; first waits for room in the first queue.
+
+        Raises the first exception of a stage. Cancelling the caller cancels
+        the stage in progress, and the item leaves the scheduler.
+        """
+        self._ensure_running()
+        entry = _Entry(item, asyncio.get_event_loop().create_future())
+        await self._enqueue(0, entry)
+        return await entry.future
+
+    async def close(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._queues is not None:
+            for queue in self._queues.values():
+                while not queue.empty():
+                    queue.get_nowait().future.cancel()
+            self._queues = None
+
+    async def _enqueue(self, index, entry: _Entry):
+        stage = self.stages[index]
+        entry.item.stage_queued(stage)
+        entry.queued_at = time.monotonic()
+        await self._queues[stage].put(entry)
+        stage_queue_depth.set(self._queues[stage].qsize(), stage=stage)
+
+    async def _work(self, index):
+        stage = self.stages[index]
+        queue = self._queues[stage]
+        while True:
+            entry = await queue.get()
+            stage_queue_depth.set(queue.qsize(), stage=stage)
+            if entry.future.done():
+                continue
+            stage_queue_seconds.observe(time.monotonic() - entry.queued_at, stage=stage)
+
+            stage_busy_workers.inc(stage=stage)
+            entry.task = asyncio.ensure_future(entry.item.run_stage(stage))
+            try:
+                await asyncio.wait([entry.task])
+            except asyncio.CancelledError:
+                entry.task.cancel()
+                raise
+            finally:
+                stage_busy_workers.inc(-1, stage=stage)
+
+            task, entry.task = entry.task, None
+            if entry.future.done():
+                continue
+            if task.cancelled():
+                entry.future.cancel()
+            elif task.exception() is not None:
+                entry.future.set_exception(task.exception())
+            elif index + 1 == len(self.stages):
+                entry.future.set_result(entry.item)
+            else:
+                # Blocks this worker while the next stage is backed up.
+                await self._enqueue(index + 1, entry)
+
+
+_scheduler = None
+
+
+def get_stage_scheduler() -> StageScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = StageScheduler()
+    return _scheduler
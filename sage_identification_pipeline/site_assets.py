@@ -0,0 +1,112 @@
+"""Publishes the app's static assets (logo, example images) to the Wave file store.
+
+A manifest records the digest and Wave path of every published file. On the
+next start, files whose digest is unchanged and that the Wave server still
+has are not uploaded again.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import httpx
+
+from .config import ASSET_MANIFEST_PATH, ASSET_UPLOAD_CONCURRENCY, WAVE_ADDRESS
+from .connections import get_wave_client
+from .metrics import asset_publications
+from .utils import file_digest
+
+logger = logging.getLogger(__name__)
+
+
+class AssetManifest:
+    """Local path -> {'digest', 'wave_path'} of the files published to `wave_address`."""
+
+    def __init__(self, path=ASSET_MANIFEST_PATH, wave_address=WAVE_ADDRESS):
+        self.path = path
+        self.wave_address = wave_address
+        self.files = {}
+        self.load()
+
+    def get(self, file_path, digest) -> Optional[str]:
+        entry = self.files.get(file_path)
+        if entry is None or entry['digest'] != digest:
+            return None
+        return entry['wave_path']
+
+    def set(self, file_path, digest, wave_path):
+        self.files[file_path] = {'digest': digest, 'wave_path': wave_path}
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r') as manifest_fp:
+                manifest = json.load(manifest_fp)
+        except (OSError, ValueError) as error:
+            logger.warning('Ignoring unreadable asset manifest %s: %s', self.path, error)
+            return
+        # Files published to another Wave server are not known to this one.
+        if manifest.get('wave_address') == self.wave_address:
+            self.files = manifest.get('files', {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as manifest_fp:
+            json.dump({'wave_address': self.wave_address, 'files': self.files}, manifest_fp)
+        os.replace(tmp_path, self.path)
+
+
+async def wave_file_exists(wave_path) -> bool:
+    try:
+        response = await get_wave_client().head(wave_path)
+    except httpx.HTTPError:
+        return False
+    return response.status_code == 200
+
+
+async def publish_file(site, file_path, manifest: AssetManifest, semaphore) -> Optional[str]:
+    """Returns the Wave path of `file_path`, or None when it could not be published."""
+    loop = asyncio.get_event_loop()
+    try:
+        digest = await loop.run_in_executor(None, file_digest, file_path)
+    except OSError as error:
+        logger.warning('Skipping asset %s: %s', file_path, error)
+        asset_publications.inc(result='missing')
+        return None
+
+    wave_path = manifest.get(file_path, digest)
+    if wave_path is not None and await wave_file_exists(wave_path):
+        asset_publications.inc(result='cached')
+        return wave_path
+
+    async with semaphore:
+        try:
+            [wave_path] = await site.upload([file_path])
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logger.warning('Uploading asset %s failed: %r', file_path, error)
+            asset_publications.inc(result='failed')
+            return None
+    manifest.set(file_path, digest, wave_path)
+    asset_publications.inc(result='uploaded')
+    return wave_path
+
+
+async def publish_assets(
+    site, file_paths: List[str], manifest: AssetManifest = None, concurrency=ASSET_UPLOAD_CONCURRENCY
+) -> Dict[str, Optional[str]]:
+    """Publishes `file_paths` concurrently; returns {file path: Wave path or None}."""
+    manifest = AssetManifest() if manifest is None else manifest
+    semaphore = asyncio.Semaphore(concurrency)
+    wave_paths = await asyncio.gather(
+        *[publish_file(site, file_path, manifest, semaphore) for file_path in file_paths]
+    )
+    try:
+        manifest.save()
+    except OSError as error:
+        logger.warning('Could not save the asset manifest: %s', error)
+    return dict(zip(file_paths, wave_paths))
@@ -0,0 +1,279 @@
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List
+
+from h2o_wave import Q
+
+from .config import RUN_REGISTRY_MAX_RUNS, RUN_REGISTRY_TTL
+from .constants import (
+    default_classification_model_tag,
+    default_detection_model_tag,
+    default_nms,
+    default_sensitivity,
+)
+from .metrics import stage_seconds
+
+RUN_IDLE = 'idle'
+RUN_RUNNING = 'running'
+RUN_COMPLETED = 'completed'
+RUN_FAILED = 'failed'
+RUN_CANCELLED = 'cancelled'
+
+PIPELINE_STAGES = ('upload', 'detection', 'classification', 'identification')
+
+
+def results_complete(results):
+    """Whether the results() of a run have no failed, skipped identifications.
+
+    Only complete results stand in for a new run of the same image.
+    """
+    return None not in (results['identification_results'] or [])
+
+
+@dataclass(frozen=True)
+class PipelineParams:
+    detection_model_tag: str = default_detection_model_tag
+    classification_model_tag: str = default_classification_model_tag
+    sensitivity: float = default_sensitivity
+    nms: float = default_nms
+
+    @classmethod
+    def from_args(cls, args):
+        defaults = cls()
+        return cls(
+            detection_model_tag=args.detection_model_tag or defaults.detection_model_tag,
+            classification_model_tag=args.classification_model_tag
+            or defaults.classification_model_tag,
+            sensitivity=defaults.sensitivity if args.sensitivity is None else args.sensitivity,
+            nms=defaults.nms if args.nms is None else args.nms,
+        )
+
+
+class StageProgress:
+    """Progress of one pipeline stage: its timing and the WBIA jobs it waits on."""
+
+    __slots__ = ('started_at', 'finished_at', 'done', 'total', 'jobs')
+
+    def __init__(self, total=None):
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.done = 0
+        self.total = total
+        # job id -> (last job status, status checks so far)
+        self.jobs = {}
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def attempts(self):
+        return sum(attempts for _status, attempts in self.jobs.values())
+
+    def job_status(self, job_id, status, attempts):
+        self.jobs[job_id] = (status, attempts)
+
+    def job_statuses(self):
+        """Returns {status: number of jobs} of the stage's jobs."""
+        counts = {}
+        for status, _attempts in self.jobs.values():
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def finish(self):
+        self.finished_at = time.monotonic()
+
+
+class PipelineRun:
+    """State of one pipeline run: its target image, stage flags and results."""
+
+    __slots__ = (
+        'run_id',
+        'target_image',
+        'params',
+        'status',
+        'error',
+        'upload_complete',
+        'detection_in_progress',
+        'detection_complete',
+        'classification_in_progress',
+        'classification_complete',
+        'identification_in_progress',
+        'identification_complete',
+        'image_digest',
+        'image_uuid',
+        'image_size',
+        'annotations',
+        'classification_results',
+        'identification_results',
+        'identification_done',
+        'reused',
+        'stages',
+        'queued_stage',
+        'created_at',
+        'touched_at',
+    )
+
+    def __init__(self, target_image=None, params: PipelineParams = PipelineParams()):
+        self.run_id = uuid.uuid4().hex
+        self.target_image = target_image
+        self.params = params
+        self.status = RUN_IDLE
+        self.created_at = time.monotonic()
+        self.touched_at = self.created_at
+        self.reset_stages()
+
+    @property
+    def running(self):
+        return self.status == RUN_RUNNING
+
+    def reset_stages(self):
+        self.error = None
+        self.upload_complete = False
+        self.detection_in_progress = False
+        self.detection_complete = False
+        self.classification_in_progress = False
+        self.classification_complete = False
+        self.identification_in_progress = False
+        self.identification_complete = False
+        self.image_digest = None
+        self.image_uuid = None
+        self.image_size = None
+        self.annotations = None
+        self.classification_results = None
+        self.identification_results = None
+        self.identification_done = 0
+        # Completed from the results of an earlier run, see restore().
+        self.reused = False
+        self.stages = OrderedDict()
+        # Stage the run waits for a free worker of (see scheduler.py).
+        self.queued_stage = None
+
+    def start_stage(self, stage, total=None) -> StageProgress:
+        self.queued_stage = None
+        progress = self.stages[stage] = StageProgress(total)
+        return progress
+
+    def finish_stage(self, stage):
+        progress = self.stages[stage]
+        progress.finish()
+        stage_seconds.observe(progress.elapsed, stage=stage)
+
+    @property
+    def stage_durations(self):
+        """Seconds spent in every finished stage, in pipeline order."""
+        return {
+            stage: progress.elapsed
+            for stage, progress in self.stages.items()
+            if progress.finished_at is not None
+        }
+
+    def results(self):
+        """The outputs of a completed run, see restore()."""
+        return {
+            'image_digest': self.image_digest,
+            'image_uuid': self.image_uuid,
+            'image_size': self.image_size,
+            'annotations': self.annotations,
+            'classification_results': self.classification_results,
+            'identification_results': self.identification_results,
+        }
+
+    def restore(self, results):
+        """Completes the run with the results() of an earlier run.
+
+        The run's status is left to the task that restores it.
+        """
+        self.reset_stages()
+        self.image_digest = results.get('image_digest')
+        self.image_uuid = results['image_uuid']
+        self.image_size = results['image_size']
+        self.annotations = results['annotations']
+        self.classification_results = results['classification_results']
+        self.identification_results = results['identification_results']
+        self.identification_done = len(self.identification_results or [])
+        self.upload_complete = True
+        self.detection_complete = True
+        self.classification_complete = True
+        self.identification_complete = True
+        self.reused = True
+
+    def clear_progress(self):
+        self.detection_in_progress = False
+        self.classification_in_progress = False
+        self.identification_in_progress = False
+
+    def touch(self):
+        self.touched_at = time.monotonic()
+
+
+class RunRegistry:
+    """Process-wide index of pipeline runs.
+
+    Runs that are not running are evicted once they have been idle for `ttl`
+    seconds, or oldest first when the registry holds more than `max_runs`.
+    Running runs are never evicted.
+    """
+
+    def __init__(self, max_runs=RUN_REGISTRY_MAX_RUNS, ttl=RUN_REGISTRY_TTL):
+        self.max_runs = max_runs
+        self.ttl = ttl
+        self._runs = OrderedDict()
+
+    def __len__(self):
+        return len(self._runs)
+
+    def create(self, target_image=None) -> PipelineRun:
+        self.evict()
+        run = PipelineRun(target_image=target_image)
+        self._runs[run.run_id] = run
+        return run
+
+    def get(self, run_id):
+        run = self._runs.get(run_id)
+        if run is not None:
+            run.touch()
+            self._runs.move_to_end(run_id)
+        return run
+
+    def evict(self):
+        idle_before = time.monotonic() - self.ttl
+        for run_id, run in list(self._runs.items()):
+            if not run.running and run.touched_at < idle_before:
+                del self._runs[run_id]
+        for run_id, run in list(self._runs.items()):
+            if len(self._runs) < self.max_runs:
+                break
+            if not run.running:
+                del self._runs[run_id]
+
+
+runs = RunRegistry()
+
+
+def start_new_session(q: Q, target_images) -> List[PipelineRun]:
+    """Starts one run per target image; the first one is displayed."""
+    session = [runs.create(target_image=image) for image in target_images]
+    q.client.session_run_ids = [run.run_id for run in session]
+    q.client.run_id = session[0].run_id
+    return session
+
+
+def start_new_run(q: Q, target_image=None) -> PipelineRun:
+    return start_new_session(q, [target_image])[0]
+
+
+def session_runs(q: Q) -> List[PipelineRun]:
+    """Returns the runs of the client's session, skipping evicted ones."""
+    session = [runs.get(run_id) for run_id in q.client.session_run_ids or []]
+    session = [run for run in session if run is not None]
+    return session or [current_run(q)]
+
+
+def current_run(q: Q) -> PipelineRun:
+    run = runs.get(q.client.run_id)
+    if run is None:
+        run = start_new_run(q)
+    return run
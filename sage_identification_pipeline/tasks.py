@@ -0,0 +1,145 @@
+import asyncio
+import logging
+
+from .config import MAX_CONCURRENT_RUNS
+from .metrics import pipeline_runs
+from .run_store import get_run_store
+from .state import (
+    RUN_CANCELLED,
+    RUN_COMPLETED,
+    RUN_FAILED,
+    RUN_RUNNING,
+    PipelineRun,
+    runs,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class RunCapacityError(Exception):
+    pass
+
+
+class PipelineTasks:
+    """Runs pipelines as background tasks so the serve handler returns at once."""
+
+    def __init__(self, max_concurrent_runs=MAX_CONCURRENT_RUNS):
+        self.max_concurrent_runs = max_concurrent_runs
+        # run id -> task; the runs of a batch share one task.
+        self._tasks = {}
+        # UI updates that outlive their serve handler, e.g. loading thumbnails.
+        self._background = set()
+
+    @property
+    def active_runs(self):
+        """Background tasks in progress; a batch of runs counts once."""
+        return len(set(self._tasks.values()))
+
+    def start(self, run: PipelineRun, coro, on_finished=None):
+        """Run `coro` for `run` in the background.
+
+        `on_finished` is an optional coroutine function awaited once the run
+        has its final status, whether it completed, failed or was cancelled.
+        """
+        try:
+            return self.start_batch([run], self._single(coro), on_finished)
+        except RunCapacityError:
+            coro.close()
+            raise
+
+    def start_batch(self, batch_runs, coro, on_finished=None):
+        """Run `coro` for several runs in one background task.
+
+        `coro` returns one exception or None per run, in order. Cancelling
+        any run of the batch cancels the whole batch.
+        """
+        if self.active_runs >= self.max_concurrent_runs:
+            coro.close()
+            raise RunCapacityError(
+                f'{self.active_runs} pipeline runs already in progress, try again later.'
+            )
+        for run in batch_runs:
+            run.status = RUN_RUNNING
+            run.error = None
+        task = asyncio.ensure_future(self._execute(batch_runs, coro, on_finished))
+        for run in batch_runs:
+            self._tasks[run.run_id] = task
+
+        def forget(_task):
+            for run in batch_runs:
+                if self._tasks.get(run.run_id) is task:
+                    del self._tasks[run.run_id]
+
+        task.add_done_callback(forget)
+        return task
+
+    async def _single(self, coro):
+        await coro
+        return [None]
+
+    async def _execute(self, batch_runs, coro, on_finished):
+        try:
+            errors = await coro
+        except asyncio.CancelledError:
+            errors = [asyncio.CancelledError()] * len(batch_runs)
+        except Exception as error:
+            logger.exception(
+                'Pipeline run %s failed', ', '.join(run.run_id for run in batch_runs)
+            )
+            errors = [error] * len(batch_runs)
+
+        for run, error in zip(batch_runs, errors):
+            if error is None:
+                run.status = RUN_COMPLETED
+            elif isinstance(error, asyncio.CancelledError):
+                run.status = RUN_CANCELLED
+            else:
+                run.status = RUN_FAILED
+                run.error = str(error) or type(error).__name__
+            if run.status != RUN_COMPLETED:
+                run.clear_progress()
+            pipeline_runs.inc(status=run.status)
+
+        try:
+            # Reused results are recorded already; recording them again would
+            # keep them reusable forever.
+            await get_run_store().record([run for run in batch_runs if not run.reused])
+        except Exception:
+            logger.exception('Recording pipeline runs failed')
+
+        if on_finished is not None:
+            try:
+                await on_finished()
+            except Exception:
+                logger.exception('Finishing pipeline runs failed')
+
+    def start_background(self, coro):
+        """Run `coro` in the background without tying it to a pipeline run.
+
+        It does not count against the run capacity, and shutdown cancels it.
+        """
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def status(self, run_id):
+        run = runs.get(run_id)
+        return None if run is None else run.status
+
+    def cancel(self, run_id):
+        task = self._tasks.get(run_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def shutdown(self):
+        tasks = list(set(self._tasks.values()) | self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+pipeline_tasks = PipelineTasks()
@@ -0,0 +1,230 @@
+"""Local cache of the identification evidence thumbnails rendered by WBIA.
+
+Every thumbnail ('clean', 'heatmask' or 'matches' version of a match) is
+fetched once through the pooled WBIA client, kept in a size-bounded directory
+and uploaded once to the Wave file store, so browsers load it from Wave.
+The preview versions are prefetched while identification results come in.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from hashlib import blake2b
+
+from .cache import LRUCache, cache_key
+from .config import (
+    THUMBNAIL_CACHE_DIR,
+    THUMBNAIL_CACHE_MAX_BYTES,
+    THUMBNAIL_FETCH_CONCURRENCY,
+)
+from .metrics import cache_requests, thumbnail_cache_bytes
+from .resilience import SageError
+
+EVIDENCE_VERSIONS = ('clean', 'heatmask', 'matches')
+# Shown with the results; the other versions are loaded on demand.
+PREVIEW_VERSIONS = ('clean',)
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_name(extern_reference, query_annot_uuid, database_annot_uuid, version):
+    key = cache_key(extern_reference, query_annot_uuid, database_annot_uuid, version)
+    return blake2b(key.encode(), digest_size=16).hexdigest() + '.jpg'
+
+
+def result_thumbnail_args(result, version):
+    return result['reference'], result['qannot_uuid'], result['dannot_uuid'], version
+
+
+class ThumbnailStore:
+    """Files in `directory` of at most `max_bytes` in total.
+
+    The least recently used files are deleted first. File modification times
+    record the use, so the order survives restarts.
+    """
+
+    def __init__(self, directory=THUMBNAIL_CACHE_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        # file name -> size, least recently used first
+        self._files = OrderedDict()
+        self.load()
+
+    def __contains__(self, name):
+        return name in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self):
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self.path(name)
+            try:
+                if name.endswith('.tmp'):
+                    # Left behind by a crash during a write.
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _mtime, name, size in sorted(entries):
+            self._files[name] = size
+            self.total_bytes += size
+        self._evict()
+
+    def get(self, name):
+        """Returns the path of file `name`, or None when it is not stored."""
+        if name not in self._files:
+            cache_requests.inc(cache='evidence_thumbnails', result='miss')
+            return None
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except OSError:
+            self._forget(name)
+            cache_requests.inc(cache='evidence_thumbnails', result='miss')
+            return None
+        self._files.move_to_end(name)
+        cache_requests.inc(cache='evidence_thumbnails', result='hit')
+        return path
+
+    def put(self, name, content: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(name)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as thumbnail_fp:
+            thumbnail_fp.write(content)
+        os.replace(tmp_path, path)
+        self._forget(name)
+        self._files[name] = len(content)
+        self.total_bytes += len(content)
+        self._evict()
+        return path
+
+    def _forget(self, name):
+        self.total_bytes -= self._files.pop(name, 0)
+
+    def _evict(self):
+        # The newest file stays, even when it alone is over the limit.
+        while self.total_bytes > self.max_bytes and len(self._files) > 1:
+            name, size = self._files.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.path(name))
+            except OSError as error:
+                logger.warning('Could not remove cached thumbnail %s: %s', name, error)
+        thumbnail_cache_bytes.set(self.total_bytes)
+
+
+class EvidenceThumbnails:
+    """Fetches evidence thumbnails into a ThumbnailStore and publishes them to Wave.
+
+    Concurrent requests for the same thumbnail share one fetch, and at most
+    `concurrency` fetches run at a time.
+    """
+
+    def __init__(self, store: ThumbnailStore = None, concurrency=THUMBNAIL_FETCH_CONCURRENCY):
+        self.store = ThumbnailStore() if store is None else store
+        self.concurrency = concurrency
+        self._semaphore = None
+        # file name -> task fetching it
+        self._fetches = {}
+        # file name -> path in the Wave file store
+        self._wave_paths = LRUCache(max_entries=16 * 1024)
+
+    async def fetch(self, sage, extern_reference, query_annot_uuid, database_annot_uuid, version):
+        """Returns the local path of a thumbnail, fetching it unless it is stored."""
+        name = thumbnail_name(extern_reference, query_annot_uuid, database_annot_uuid, version)
+        path = self.store.get(name)
+        if path is not None:
+            return path
+        task = self._fetches.get(name)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._download(
+                    sage, name, extern_reference, query_annot_uuid, database_annot_uuid, version
+                )
+            )
+            self._fetches[name] = task
+            task.add_done_callback(lambda _task: self._fetches.pop(name, None))
+        # A cancelled waiter leaves the fetch running for the others.
+        return await asyncio.shield(task)
+
+    async def _download(self, sage, name, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            content = await sage.fetch_match_thumbnail(*args)
+        return self.store.put(name, content)
+
+    async def prefetch(self, sage, result, versions=EVIDENCE_VERSIONS):
+        """Fetches `versions` of the evidence of an identification result."""
+        if not result:
+            return
+        fetches = [
+            self.fetch(sage, *result_thumbnail_args(result, version)) for version in versions
+        ]
+        for outcome in await asyncio.gather(*fetches, return_exceptions=True):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            if isinstance(outcome, (SageError, OSError)):
+                logger.warning('Prefetching evidence thumbnail failed: %s', outcome)
+            elif isinstance(outcome, Exception):
+                logger.error('Prefetching evidence thumbnail failed: %r', outcome)
+
+    async def publish(self, site, results, versions=EVIDENCE_VERSIONS):
+        """Returns one {version: Wave path} dict per identification result.
+
+        Only thumbnails already stored locally are included; they are uploaded
+        to the Wave file store of `site` on first use.
+        """
+        urls = [{} for _result in results]
+        pending = []
+        for index, result in enumerate(results):
+            if not result:
+                continue
+            for version in versions:
+                name = thumbnail_name(*result_thumbnail_args(result, version))
+                wave_path = self._wave_paths.get(name)
+                if wave_path is not None:
+                    urls[index][version] = wave_path
+                    continue
+                path = self.store.get(name)
+                if path is not None:
+                    pending.append((index, version, name, path))
+        if pending:
+            try:
+                wave_paths = await site.upload([path for _i, _v, _n, path in pending])
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.warning('Uploading evidence thumbnails to Wave failed: %r', error)
+                return urls
+            for (index, version, name, _path), wave_path in zip(pending, wave_paths):
+                self._wave_paths.set(name, wave_path)
+                urls[index][version] = wave_path
+        return urls
+
+    async def close(self):
+        tasks = list(self._fetches.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_evidence_thumbnails = None
+
+
+def get_evidence_thumbnails() -> EvidenceThumbnails:
+    global _evidence_thumbnails
+    if _evidence_thumbnails is None:
+        _evidence_thumbnails = EvidenceThumbnails()
+    return _evidence_thumbnails
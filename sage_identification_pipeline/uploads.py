@@ -0,0 +1,150 @@
+import binascii
+import os
+import tempfile
+from hashlib import blake2b
+from typing import AsyncIterator, BinaryIO, Optional, Tuple
+
+import httpx
+
+from .config import UPLOAD_CHUNK_SIZE, UPLOAD_SPOOL_DIR
+from .connections import get_wave_client
+
+
+class MultipartUpload:
+    """A single-file multipart/form-data body, streamed chunk by chunk.
+
+    The bytes are hashed as they are sent, so `hexdigest()` matches
+    `utils.file_digest` of the same image once the body has been consumed.
+    The body can only be sent once.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        chunks: AsyncIterator[bytes],
+        size: Optional[int] = None,
+        field: str = 'image',
+    ):
+        self.filename = filename
+        self.size = size
+        self._chunks = chunks
+        self._sent = False
+        self._digest = blake2b(digest_size=32)
+        boundary = binascii.hexlify(os.urandom(16))
+        self._preamble = b''.join(
+            [
+                b'--' + boundary + b'\r\n',
+                f'Content-Disposition: form-data; name="{field}"; '
+                f'filename="{filename}"\r\n'.encode(),
+                b'Content-Type: application/octet-stream\r\n\r\n',
+            ]
+        )
+        self._epilogue = b'\r\n--' + boundary + b'--\r\n'
+        self.content_type = f'multipart/form-data; boundary={boundary.decode()}'
+
+    @classmethod
+    def from_file(cls, path: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> 'MultipartUpload':
+        return cls(
+            os.path.basename(path), read_file_chunks(path, chunk_size), os.path.getsize(path)
+        )
+
+    def __repr__(self):
+        return f'MultipartUpload({self.filename!r}, size={self.size})'
+
+    @property
+    def headers(self):
+        headers = {'Content-Type': self.content_type}
+        if self.size is not None:
+            # Without it httpx falls back to chunked transfer encoding.
+            headers['Content-Length'] = str(
+                len(self._preamble) + self.size + len(self._epilogue)
+            )
+        return headers
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    async def __aiter__(self):
+        if self._sent:
+            raise RuntimeError(f'{self!r} was already sent')
+        self._sent = True
+        yield self._preamble
+        async for chunk in self._chunks:
+            self._digest.update(chunk)
+            yield chunk
+        yield self._epilogue
+
+
+async def read_file_chunks(path: str, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    with open(path, 'rb') as fp:
+        async for chunk in iter_file_chunks(fp, chunk_size):
+            yield chunk
+
+
+async def iter_file_chunks(fp: BinaryIO, chunk_size: int = UPLOAD_CHUNK_SIZE):
+    for chunk in iter(lambda: fp.read(chunk_size), b''):
+        yield chunk
+
+
+class WaveFile:
+    """A file in the Wave server's file store, e.g. an uploaded target image."""
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def __repr__(self):
+        return f'WaveFile({self.url!r})'
+
+    @property
+    def filename(self):
+        return os.path.basename(self.url)
+
+    def stream(self):
+        return get_wave_client().stream('GET', self.url)
+
+
+def content_length(response: httpx.Response) -> Optional[int]:
+    """Size of the raw body, or None when it is unknown or encoded."""
+    if 'Content-Encoding' in response.headers:
+        return None
+    try:
+        return int(response.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return None
+
+
+async def spool_response(response: httpx.Response, filename: str) -> str:
+    """Writes the body to a temp file the caller must remove."""
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=UPLOAD_SPOOL_DIR, suffix=f'-{filename}')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            async for chunk in response.aiter_bytes():
+                fp.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+async def spool_and_hash(
+    response: httpx.Response, max_memory: int = UPLOAD_CHUNK_SIZE
+) -> Tuple[BinaryIO, str]:
+    """Copies the body into a spooled temp file, hashing it as it arrives.
+
+    Up to `max_memory` bytes stay in memory, the rest goes to a temp file.
+    Returns the rewound file, which the caller must close, and the body's
+    digest, which matches `utils.file_digest`.
+    """
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    spool = tempfile.SpooledTemporaryFile(max_size=max_memory, dir=UPLOAD_SPOOL_DIR)
+    digest = blake2b(digest_size=32)
+    try:
+        async for chunk in response.aiter_bytes():
+            digest.update(chunk)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, digest.hexdigest()
@@ -1,4 +1,5 @@
 import json
+import logging
 import os
 import re
 import socket
@@ -9,9 +10,12 @@ from hashlib import blake2b
 from typing import Dict
 from zipfile import ZipFile
 
-import httpx
 import requests
 
+from .connections import get_client
+
+logger = logging.getLogger(__name__)
+
 
 def now():
     """Returns current UTC timestamp."""
@@ -28,7 +32,7 @@ def dict2json(data: Dict, file_name: str) -> str:
 def json2dict(json_file: str) -> dict:
     json_dict = {}
     if not os.path.isfile(os.path.abspath(json_file)):
-        print(f"Error: '{json_file}' is not a file.")  # noqa
+        logger.error("'%s' is not a file.", json_file)
     else:
         with open(os.path.abspath(json_file), "r") as json_fp:
             json_dict = json.load(json_fp)
@@ -40,7 +44,8 @@ def get_files_in_dir(dir_path, pattern, ext):
     with os.scandir(dir_path) as it:
         for entry in it:
             if (
-                entry.name.endswith(f".{ext}")
+                # Camera traps name their images e.g. IMG_0001.JPG.
+                entry.name.lower().endswith(f".{ext.lower()}")
                 and pattern in entry.name
                 and entry.is_file()
             ):
@@ -77,9 +82,9 @@ def zip_dir(dir_path):
     os.chdir(os.path.dirname(dir_abspath))
     with ZipFile(zip_path, "w") as my_zip:
         for root, _dirs, files in os.walk(os.path.basename(dir_abspath)):
-            print(f'root: {root}')
+            logger.debug('root: %s', root)
             for file in files:
-                print(f'file: {file}')
+                logger.debug('file: %s', file)
                 my_zip.write(os.path.join(root, file))
     os.chdir(cwd)
     return zip_path
@@ -112,6 +117,13 @@ def lines_matching_regex(lines, match_regex, num_after=None):
 def get_hostname():
     return socket.gethostname()
 
+def file_digest(file_path, chunk_size=1024 * 1024):
+    digest = blake2b(digest_size=32)
+    with open(os.path.abspath(file_path), 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def json_dump_data(data):
     converted_data = {}
     for key in data:
@@ -131,54 +143,46 @@ def safe_request(
         response.raise_for_status()
     except requests.exceptions.HTTPError as http_error:
         # response.status_code != 200
-        print(f"Http Error: {http_error}")
+        logger.warning("Http Error: %s", http_error)
         # print('Http Error')
         return None
     except requests.exceptions.ConnectionError as connection_error:
-        print(f"Connection Error: {connection_error}")
+        logger.warning("Connection Error: %s", connection_error)
         return None
     except requests.exceptions.Timeout as timeout_error:
-        print(f"Timeout Error: {timeout_error}")
+        logger.warning("Timeout Error: %s", timeout_error)
         return None
     except requests.exceptions.RequestException as unknown_error:
         # An unknown error occurred
-        print(f"Unknown Error: {unknown_error}")
+        logger.warning("Unknown Error: %s", unknown_error)
         return None
     # response.status_code == 200
     if response:
         if message is not None:
-            print(message)
+            logger.info(message)
         # return response.json()
         return response
     else:
         return None
 
 
-def download_file(url, file_path):
+async def download_file(url, file_path, headers=None):
     file_abspath = os.path.abspath(file_path)
     parent_dir = os.path.dirname(file_abspath)
     if not os.path.isdir(parent_dir):
         os.makedirs(parent_dir, exist_ok=False)
-    # r = requests.get(url, allow_redirects=True)
-    # r = requests.get(url)
-    r = safe_request(
-        request_job=requests.get, url=url, options={'allow_redirects': True}
-    )
-    with open(file_abspath, 'wb') as fp:
-        fp.write(r.content)
+    client = get_client()
+    async with client.stream('GET', url, headers=headers, allow_redirects=True) as r:
+        r.raise_for_status()
+        with open(file_abspath, 'wb') as fp:
+            async for chunk in r.aiter_bytes():
+                fp.write(chunk)
     return file_abspath
 
-def get_file(url, file_path, access_token):
-    file_abspath = os.path.abspath(file_path)
-    parent_dir = os.path.dirname(file_abspath)
-    if not os.path.isdir(parent_dir):
-        os.makedirs(parent_dir, exist_ok=False)
-
-    auth = MyCustomAuth(access_token=access_token)
-    r = httpx.get(url=url, auth=auth)
-    with open(file_abspath, 'wb') as fp:
-        fp.write(r.content)
-    return file_abspath
+async def get_file(url, file_path, access_token):
+    return await download_file(
+        url, file_path, headers={'Authorization': f'Bearer {access_token}'}
+    )
 
 def size_human_readable(bytes: int) -> str:
     if bytes > 10 ** 9:
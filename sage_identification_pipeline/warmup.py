@@ -0,0 +1,128 @@
+"""Optional warm-up of the pipeline results of the bundled example images.
+
+The pipeline runs on every example image at default parameters in the
+background, at startup and every WARMUP_INTERVAL seconds. The results are
+persisted, keyed by image digest and parameters, and a run of an example image
+with the same parameters is completed from them without calling WBIA.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from .cache import LRUCache, cache_key
+from .config import WARMUP_ENABLED, WARMUP_INTERVAL, WARMUP_RESULTS_PATH, WBIA_API_PREFIX
+from .constants import example_images
+from .sage import execute_pipelines
+from .sage_client import SageClient
+from .state import PipelineParams, PipelineRun, results_complete
+from .thumbnails import get_evidence_thumbnails
+from .utils import file_digest
+
+logger = logging.getLogger(__name__)
+
+# (WBIA server, image digest, params) -> results of a complete run, see snapshot_run.
+warm_results = LRUCache(name='warm_results', max_entries=256, path=WARMUP_RESULTS_PATH)
+
+_digests = {}
+_task = None
+
+
+async def image_digest(image_path):
+    digest = _digests.get(image_path)
+    if digest is None:
+        loop = asyncio.get_event_loop()
+        digest = _digests[image_path] = await loop.run_in_executor(None, file_digest, image_path)
+    return digest
+
+
+def warm_key(digest, params: PipelineParams):
+    return cache_key(
+        WBIA_API_PREFIX,
+        digest,
+        params.detection_model_tag,
+        params.classification_model_tag,
+        params.sensitivity,
+        params.nms,
+    )
+
+
+def snapshot_run(run: PipelineRun):
+    return dict(run.results(), warmed_at=time.time())
+
+
+async def find_warm_result(app_example_images, run: PipelineRun) -> Optional[dict]:
+    """Returns the warm-up results for `run`, if it runs a warmed-up example image."""
+    if not WARMUP_ENABLED:
+        return None
+    for image in app_example_images or []:
+        if image['wave_path'] == run.target_image:
+            return warm_results.get(warm_key(await image_digest(image['path']), run.params))
+    return None
+
+
+async def warm_up_examples(sage: SageClient, images=example_images, params=PipelineParams()):
+    """Runs the pipeline on `images`; returns the number of runs that completed."""
+    paths = [image['path'] for image in images if os.path.isfile(image['path'])]
+    runs = [PipelineRun(target_image=path, params=params) for path in paths]
+    started = time.monotonic()
+    errors = await execute_pipelines(sage, runs, paths, evidence=get_evidence_thumbnails())
+    completed = 0
+    for path, run, error in zip(paths, runs, errors):
+        if error is not None:
+            logger.warning('Warming up %s failed: %s', path, error)
+            continue
+        if not results_complete(run.results()):
+            logger.warning('Warming up %s failed: an identification failed', path)
+            continue
+        warm_results.set(warm_key(await image_digest(path), params), snapshot_run(run))
+        completed += 1
+    logger.info(
+        'Warmed up %s of %s example images in %.0fs',
+        completed,
+        len(paths),
+        time.monotonic() - started,
+    )
+    return completed
+
+
+async def next_warm_up_delay(images=example_images, params=PipelineParams()):
+    """Seconds until the oldest persisted result of `images` is due for a refresh."""
+    delay = WARMUP_INTERVAL
+    for image in images:
+        if not os.path.isfile(image['path']):
+            continue
+        result = warm_results.get(warm_key(await image_digest(image['path']), params))
+        if result is None:
+            return 0
+        delay = min(delay, result['warmed_at'] + WARMUP_INTERVAL - time.time())
+    return max(delay, 0)
+
+
+async def warm_up_forever(sage: SageClient):
+    # Results persisted by an earlier process are reused until due.
+    delay = await next_warm_up_delay()
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await warm_up_examples(sage)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Warming up the example images failed')
+        delay = WARMUP_INTERVAL
+
+
+def start_warm_up(sage: SageClient):
+    global _task
+    if WARMUP_ENABLED and _task is None:
+        _task = asyncio.ensure_future(warm_up_forever(sage))
+
+
+async def stop_warm_up():
+    global _task
+    task, _task = _task, None
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
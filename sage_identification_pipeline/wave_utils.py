@@ -1,3 +1,4 @@
+import logging
 import os
 import sys
 import traceback
@@ -8,9 +9,12 @@ from typing import Any, Callable, Optional
 from h2o_wave import Q, ui
 from h2o_wave.core import expando_to_dict
 
+from .logs import sampled, truncate
 from .utils import get_hostname
 from sage_identification_pipeline import GLOBAL_HANDLERS
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class WaveColors:
@@ -106,7 +110,7 @@ def handler(qualifier: Optional[Callable[[Q, Any], bool]] = default_qualifier):
         @wraps(func)
         async def handle_func(q: Q, *args, **kwargs):
             if qualifier(q, func.__name__):
-                print(f'Calling {func.__name__} ...')
+                logger.debug('Calling handler %s', func.__name__)
                 await func(q, *args, **kwargs)
 
         GLOBAL_HANDLERS.append(handle_func)
@@ -114,12 +118,9 @@ def handler(qualifier: Optional[Callable[[Q, Any], bool]] = default_qualifier):
 
     return handler_decorator
 
-def print_q_args(q_args):
-    print('>>>> q.args >>>>')
-    q_args_dict = expando_to_dict(q_args)
-    for k, v in q_args_dict.items():
-        print(f'{k}: {v}')
-    print('<<<< q.args <<<<')
+def log_q_args(q_args):
+    if logger.isEnabledFor(logging.DEBUG) and sampled():
+        logger.debug('q.args %s', truncate(expando_to_dict(q_args)))
 
 async def make_access_denied_card(q: Q, card_name, box):
     items = [
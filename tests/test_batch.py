@@ -0,0 +1,15 @@
+from sage_identification_pipeline.batch import find_images
+
+
+def test_find_images_matches_extensions_in_any_case(tmp_path):
+    for name in ('IMG_0001.JPG', 'IMG_0002.jpeg', 'zebra.PNG', 'notes.txt'):
+        (tmp_path / name).write_bytes(b'')
+    (tmp_path / 'trap').mkdir()
+    (tmp_path / 'trap' / 'IMG_0003.Jpg').write_bytes(b'')
+
+    images = find_images(str(tmp_path), recursive=True)
+
+    assert images == sorted(
+        str(tmp_path / name)
+        for name in ('IMG_0001.JPG', 'IMG_0002.jpeg', 'zebra.PNG', 'trap/IMG_0003.Jpg')
+    )
@@ -0,0 +1,55 @@
+import asyncio
+import json
+
+from sage_identification_pipeline.cache import LRUCache
+
+
+def read_entries(path):
+    with open(path) as cache_fp:
+        return {key: value for key, _expires_at, value in json.load(cache_fp)}
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    assert 'a' in cache and 'c' in cache
+    assert 'b' not in cache
+
+
+def test_saves_at_once_outside_event_loop(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    LRUCache(path=path).set('a', 1)
+
+    assert LRUCache(path=path).get('a') == 1
+
+
+def test_debounces_saves_inside_event_loop(tmp_path):
+    path = tmp_path / 'cache.json'
+    cache = LRUCache(path=str(path), save_delay=0.05)
+
+    async def run():
+        cache.set('a', 1)
+        cache.set('b', 2)
+        written_at_once = path.exists()
+        await asyncio.sleep(0.2)
+        return written_at_once
+
+    assert not asyncio.run(run())
+    assert read_entries(path) == {'a': 1, 'b': 2}
+
+
+def test_flush_writes_pending_changes(tmp_path):
+    path = tmp_path / 'cache.json'
+    cache = LRUCache(path=str(path), save_delay=60.0)
+
+    async def run():
+        cache.set('a', 1)
+        await cache.flush()
+
+    asyncio.run(run())
+
+    assert read_entries(path) == {'a': 1}
@@ -0,0 +1,190 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from sage_identification_pipeline import jobs
+from sage_identification_pipeline.jobs import (
+    JobFailedError,
+    JobMultiplexer,
+    JobTimeoutError,
+    PollPolicy,
+    wait_for_job,
+)
+from sage_identification_pipeline.resilience import CircuitBreaker
+
+FAST_POLICY = PollPolicy(initial_delay=0.01, max_delay=0.02, jitter=0.0, timeout=5.0)
+
+
+class StatusStub:
+    """Serves /api/engine/job/status/ from a scripted list of statuses per job.
+
+    A status of None answers with a 502; the last status of a job repeats.
+    """
+
+    def __init__(self, statuses, latency=0.0):
+        self.statuses = statuses
+        self.latency = latency
+        self.checks = []
+
+    def app(self):
+        return Starlette(routes=[Route('/api/engine/job/status/', self.job_status)])
+
+    async def job_status(self, request):
+        job_id = request.query_params['jobid']
+        self.checks.append(job_id)
+        await asyncio.sleep(self.latency)
+        statuses = self.statuses[job_id]
+        status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+        if status is None:
+            return Response(b'Bad Gateway', status_code=502)
+        return JSONResponse({'status': {'success': True}, 'response': {'jobstatus': status}})
+
+
+async def with_multiplexer(stub, run, breaker=None):
+    async with httpx.AsyncClient(app=stub.app(), base_url='http://wbia') as client:
+        multiplexer = JobMultiplexer(
+            tick_interval=0.01,
+            client=client,
+            breaker=breaker or CircuitBreaker(failure_threshold=3, reset_timeout=0.05),
+        )
+        try:
+            return await run(multiplexer)
+        finally:
+            await multiplexer.close()
+
+
+def test_wait_returns_completed_status():
+    stub = StatusStub({'job-1': ['received', 'working', 'completed']})
+    seen = []
+
+    async def run(multiplexer):
+        on_status = lambda job_id, status, attempts: seen.append((status, attempts))
+        return await multiplexer.wait('job-1', FAST_POLICY, on_status)
+
+    result = asyncio.run(with_multiplexer(stub, run))
+
+    assert result['response']['jobstatus'] == 'completed'
+    assert seen == [('received', 1), ('working', 2), ('completed', 3)]
+
+
+def test_wait_raises_on_failed_status():
+    stub = StatusStub({'job-1': ['working', 'exception']})
+
+    async def run(multiplexer):
+        return await multiplexer.wait('job-1', FAST_POLICY)
+
+    with pytest.raises(JobFailedError) as error:
+        asyncio.run(with_multiplexer(stub, run))
+    assert error.value.status == 'exception'
+
+
+def test_wait_without_job_id_fails():
+    async def run(multiplexer):
+        return await multiplexer.wait(None, FAST_POLICY)
+
+    with pytest.raises(JobFailedError):
+        asyncio.run(with_multiplexer(StatusStub({}), run))
+
+
+def test_wait_times_out_at_deadline():
+    stub = StatusStub({'job-1': ['working']})
+    policy = PollPolicy(initial_delay=0.01, max_delay=0.02, jitter=0.0, timeout=0.2)
+
+    async def run(multiplexer):
+        return await multiplexer.wait('job-1', policy)
+
+    with pytest.raises(JobTimeoutError) as error:
+        asyncio.run(with_multiplexer(stub, run))
+    assert error.value.attempts >= 2
+
+
+def test_jobs_share_status_checks():
+    stub = StatusStub({'job-1': ['working', 'completed']})
+
+    async def run(multiplexer):
+        return await asyncio.gather(
+            multiplexer.wait('job-1', FAST_POLICY), multiplexer.wait('job-1', FAST_POLICY)
+        )
+
+    first, second = asyncio.run(with_multiplexer(stub, run))
+
+    assert first == second
+    assert stub.checks == ['job-1', 'job-1']
+
+
+def test_cancelled_waiter_drops_job():
+    stub = StatusStub({'job-1': ['working']})
+
+    async def run(multiplexer):
+        waiter = asyncio.ensure_future(multiplexer.wait('job-1', FAST_POLICY))
+        await asyncio.sleep(0.1)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        checks = len(stub.checks)
+        await asyncio.sleep(0.1)
+        return multiplexer.pending_jobs, checks, len(stub.checks)
+
+    pending_jobs, checks_at_cancel, checks = asyncio.run(with_multiplexer(stub, run))
+
+    assert pending_jobs == 0
+    assert checks_at_cancel > 0
+    assert checks == checks_at_cancel
+
+
+def test_close_cancels_in_flight_status_check():
+    stub = StatusStub({'job-1': ['working']}, latency=10.0)
+
+    async def run(multiplexer):
+        waiter = asyncio.ensure_future(multiplexer.wait('job-1', FAST_POLICY))
+        while not stub.checks:
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(multiplexer.close(), timeout=1.0)
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(with_multiplexer(stub, run))
+
+
+def test_one_failed_tick_counts_once_against_breaker():
+    job_ids = [f'job-{i}' for i in range(5)]
+    stub = StatusStub({job_id: [None, 'completed'] for job_id in job_ids})
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60.0)
+    policy = PollPolicy(initial_delay=0.05, max_delay=0.05, jitter=0.0, timeout=5.0)
+
+    async def run(multiplexer):
+        return await asyncio.gather(*[multiplexer.wait(job_id, policy) for job_id in job_ids])
+
+    results = asyncio.run(with_multiplexer(stub, run, breaker))
+
+    assert [result['response']['jobstatus'] for result in results] == ['completed'] * 5
+    assert not breaker.is_open
+
+
+def test_jobs_stay_pending_while_breaker_is_open():
+    stub = StatusStub({'job-1': [None, None, 'working', 'completed']})
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+
+    async def run(multiplexer):
+        return await multiplexer.wait('job-1', FAST_POLICY)
+
+    result = asyncio.run(with_multiplexer(stub, run, breaker))
+
+    assert result['response']['jobstatus'] == 'completed'
+    assert not breaker.is_open
+
+
+def test_wait_for_job_uses_process_multiplexer(monkeypatch):
+    stub = StatusStub({'job-1': ['completed']})
+
+    async def run(multiplexer):
+        monkeypatch.setattr(jobs, '_multiplexer', multiplexer)
+        return await wait_for_job('job-1', FAST_POLICY)
+
+    result = asyncio.run(with_multiplexer(stub, run))
+
+    assert result['response']['jobstatus'] == 'completed'
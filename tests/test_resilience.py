@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+import pytest
+
+from sage_identification_pipeline.resilience import (
+    CircuitBreaker,
+    RetryPolicy,
+    SageRequestError,
+    SageUnavailableError,
+    call_with_retries,
+)
+
+NO_RETRIES = RetryPolicy(attempts=1)
+
+
+def status_error(status_code):
+    request = httpx.Request('GET', 'http://wbia/api/')
+    response = httpx.Response(status_code, request=request)
+    return httpx.HTTPStatusError(f'{status_code}', request=request, response=response)
+
+
+def failing_call(status_code):
+    async def make_call():
+        raise status_error(status_code)
+
+    return make_call
+
+
+async def succeeding_call():
+    return 'ok'
+
+
+def call(make_call, breaker, policy=NO_RETRIES):
+    return asyncio.run(call_with_retries('call', make_call, breaker, policy, idempotent=True))
+
+
+def open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    with pytest.raises(SageRequestError):
+        call(failing_call(502), breaker)
+    assert breaker.is_open
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60.0)
+    for _attempt in range(2):
+        with pytest.raises(SageRequestError):
+            call(failing_call(503), breaker)
+
+    with pytest.raises(SageUnavailableError):
+        call(succeeding_call, breaker)
+
+
+def test_client_errors_do_not_open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60.0)
+    with pytest.raises(SageRequestError):
+        call(failing_call(404), breaker)
+
+    assert not breaker.is_open
+
+
+def test_successful_trial_closes_breaker():
+    breaker = open_breaker()
+
+    assert call(succeeding_call, breaker) == 'ok'
+    assert not breaker.is_open
+
+
+def test_trial_ending_with_client_error_does_not_stick():
+    breaker = open_breaker()
+    with pytest.raises(SageRequestError):
+        call(failing_call(404), breaker)
+
+    assert call(succeeding_call, breaker) == 'ok'
+    assert not breaker.is_open
+
+
+def test_cancelled_trial_does_not_stick():
+    breaker = open_breaker()
+
+    async def cancel_trial():
+        trial = asyncio.ensure_future(
+            call_with_retries('call', lambda: asyncio.sleep(10), breaker, NO_RETRIES, True)
+        )
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+    asyncio.run(cancel_trial())
+
+    assert call(succeeding_call, breaker) == 'ok'
+
+
+def test_retried_trial_is_not_blocked_by_itself():
+    breaker = open_breaker()
+    attempts = []
+
+    async def flaky_call():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise status_error(502)
+        return 'ok'
+
+    policy = RetryPolicy(attempts=2, initial_delay=0.0, max_delay=0.0)
+    assert call(flaky_call, breaker, policy) == 'ok'
+    assert not breaker.is_open
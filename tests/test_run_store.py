@@ -0,0 +1,72 @@
+import asyncio
+import sqlite3
+
+from sage_identification_pipeline.run_store import SCHEMA, RunStore
+from sage_identification_pipeline.state import RUN_COMPLETED, PipelineParams, PipelineRun
+
+
+def completed_run(identification_results):
+    run = PipelineRun(target_image='image.jpg', params=PipelineParams())
+    run.restore(
+        {
+            'image_digest': 'digest',
+            'image_uuid': 'uuid',
+            'image_size': [640, 480],
+            'annotations': [{'uuid': 'a1'}, {'uuid': 'a2'}],
+            'classification_results': [{'class': 'zebra'}, {'class': 'zebra'}],
+            'identification_results': identification_results,
+        }
+    )
+    run.status = RUN_COMPLETED
+    return run
+
+
+def latest_results(path, runs, server='https://wbia', lookup_server=None):
+    async def run():
+        store = RunStore(str(path), server)
+        lookup_store = RunStore(str(path), lookup_server or server)
+        try:
+            for batch in runs:
+                await store.record([batch])
+            return await lookup_store.latest_results('digest', PipelineParams(), max_age=60)
+        finally:
+            await store.close()
+            await lookup_store.close()
+
+    return asyncio.run(run())
+
+
+def test_reuses_latest_complete_run(tmp_path):
+    first = completed_run([{'match': 1}, {'match': 2}])
+    second = completed_run([{'match': 3}, {'match': 4}])
+
+    result = latest_results(tmp_path / 'runs.sqlite3', [first, second])
+
+    assert result['run_id'] == second.run_id
+    assert result['identification_results'] == [{'match': 3}, {'match': 4}]
+
+
+def test_skips_runs_with_failed_identifications(tmp_path):
+    complete = completed_run([{'match': 1}, {'match': 2}])
+    partial = completed_run([{'match': 3}, None])
+
+    assert latest_results(tmp_path / 'runs.sqlite3', [partial]) is None
+    assert latest_results(tmp_path / 'both.sqlite3', [complete, partial])['run_id'] == complete.run_id
+
+
+def test_skips_runs_against_other_servers(tmp_path):
+    run = completed_run([{'match': 1}, {'match': 2}])
+
+    assert latest_results(tmp_path / 'runs.sqlite3', [run], lookup_server='https://other') is None
+
+
+def test_adds_server_column_to_existing_database(tmp_path):
+    path = tmp_path / 'runs.sqlite3'
+    connection = sqlite3.connect(str(path))
+    connection.executescript(
+        SCHEMA.replace('    server TEXT,\n', '').replace('    server, image_digest', '    image_digest')
+    )
+    connection.close()
+    run = completed_run([{'match': 1}, {'match': 2}])
+
+    assert latest_results(path, [run])['run_id'] == run.run_id
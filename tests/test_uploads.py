@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+from sage_identification_pipeline.uploads import (
+    MultipartUpload,
+    iter_file_chunks,
+    spool_and_hash,
+)
+from sage_identification_pipeline.utils import file_digest
+
+IMAGE_PATH = 'sage_identification_pipeline/assets/logo.png'
+
+
+def test_spool_and_hash_spills_to_disk_and_matches_file_digest():
+    with open(IMAGE_PATH, 'rb') as image_fp:
+        content = image_fp.read()
+
+    async def image(request):
+        return Response(content, media_type='image/png')
+
+    async def run():
+        app = Starlette(routes=[Route('/_f/logo.png', image)])
+        async with httpx.AsyncClient(app=app, base_url='http://wave') as client:
+            async with client.stream('GET', '/_f/logo.png') as response:
+                spool, digest = await spool_and_hash(response, max_memory=1024)
+        with spool:
+            rolled_to_disk = spool._rolled
+            body = MultipartUpload('logo.png', iter_file_chunks(spool, 1000), len(content))
+            sent = b''.join([chunk async for chunk in body])
+        return rolled_to_disk, digest, body.hexdigest(), sent
+
+    rolled_to_disk, digest, sent_digest, sent = asyncio.run(run())
+
+    assert rolled_to_disk
+    assert digest == sent_digest == file_digest(IMAGE_PATH)
+    assert content in sent
+    assert os.path.basename(IMAGE_PATH).encode() in sent